@@ -11,78 +11,219 @@ import openpyxl
 from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
 from openpyxl.utils import get_column_letter
 from datetime import datetime, date
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+from decimal import Decimal, ROUND_HALF_UP
+from operator import itemgetter
+import bisect
 import copy
+import glob
+import hashlib
+import json
+import os
+import pickle
+import socket
+import threading
+import time
+from contextlib import contextmanager, ExitStack
 
-def improve_bond_data_table(wb):
+# 台账结构: 各字段对应的表头及工作表/表格名称
+# 不同台账布局可在inventory_schema.json中覆盖(见load_schema),列位置按表头在每个工作簿中解析一次
+SCHEMA_FILE_NAME = 'inventory_schema.json'
+LEDGER_FIELDS = ('序号', '出库日期', '规格', '个数', '毛重', '除皮', '净重', '出库对象', '入账', '备注')
+OPTIONAL_FIELDS = ('序号', '个数', '备注')  # 台账中可以没有的字段
+DEFAULT_SCHEMA = {
+    'data_sheet': 'BondDataSheet',
+    'data_table': 'BondDataTable',
+    'template_sheet': 'TemplateSheet',
+    'headers': {field: field for field in LEDGER_FIELDS},
+}
+LEDGER_SCHEMA = copy.deepcopy(DEFAULT_SCHEMA)  # 当前使用的结构
+
+# 销售清单固定内容
+COMPANY_NAME = "东阳市欧亚金银丝有限公司"
+INVOICE_REMARK = "备注: 1. 建议用户试样,如有质量问题,请在3日内退回。2. 如果发生法律纠纷,由东阳市人民法院管辖。"
+INVOICE_CONTACT = "手机: 18606833896, 18606886823  电话: 0579-86985290  传真: 0579-86985471"
+
+# 销售清单版式,也是工作表名称的后缀
+INVOICE_VARIANTS = ('简单版', '详细版')
+
+# 价格表: 工作簿中的工作表名称及表头(出库对象为空表示适用于所有客户)
+PRICE_SHEET_NAME = 'PriceSheet'
+PRICE_HEADERS = ('出库对象', '规格', '生效日期', '单价')
+
+# 导出时每批写入的行数,控制导出大表时的内存占用
+EXPORT_CHUNK_ROWS = 10000
+
+# 台账解析缓存(位于当前用户自己的缓存目录,见_cache_dir)
+CACHE_DIR_NAME = 'inventory_cache'
+CACHE_DIR_ENV = 'INVENTORY_CACHE_DIR'  # 设置该环境变量时使用指定的目录
+CACHE_MAX_ENTRIES = 8  # 最多保留的缓存条目数,超出按最近最少使用淘汰
+CACHE_VERSION = 2  # 记录格式变化时递增,旧缓存自动失效
+
+# 多人共用台账时的锁文件(<文件名>.lock),持有者定期刷新修改时间
+LOCK_STALE_SECONDS = 120  # 锁文件超过该时间未刷新视为持有者已异常退出
+LOCK_HEARTBEAT_SECONDS = 20
+LOCK_WAIT_TIMEOUT = 600  # 等待其他用户的最长时间
+
+# 月度汇总工作表,由隐藏的汇总数据工作表(按出库日期、客户和规格)生成
+SUMMARY_SHEET_NAME = '月度汇总'
+SUMMARY_HEADERS = ('月份', '出库对象', '规格', '件数', '净重(kg)', '金额(元)')
+SUMMARY_DATA_SHEET_NAME = '汇总数据'
+SUMMARY_DATA_HEADERS = ('出库日期', '出库对象', '规格', '件数', '净重(kg)', '金额(元)')
+
+# 数据检查报告工作表
+VALIDATION_SHEET_NAME = '数据检查'
+
+def load_schema(path=None):
+    """
+    加载台账结构配置(JSON),未配置的项使用DEFAULT_SCHEMA
+    配置示例: {"data_sheet": "出库台账", "headers": {"出库对象": "客户", "入账": "已开单"}}
+    path为None时恢复默认结构
+    返回: 当前使用的结构
+    """
+    global LEDGER_SCHEMA
+    
+    schema = copy.deepcopy(DEFAULT_SCHEMA)
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        
+        unknown = [key for key in config if key not in DEFAULT_SCHEMA]
+        unknown += [field for field in config.get('headers', {}) if field not in LEDGER_FIELDS]
+        if unknown:
+            raise ValueError(f"台账结构配置 {path} 中有未知的项: {', '.join(unknown)}")
+        
+        schema['headers'].update(config.pop('headers', {}))
+        schema.update(config)
+    
+    LEDGER_SCHEMA = schema
+    return schema
+
+def find_schema_file(input_file):
+    """在输入文件所在目录和当前目录中查找SCHEMA_FILE_NAME,找不到返回None"""
+    for dir_name in (os.path.dirname(os.path.abspath(input_file)), os.getcwd()):
+        path = os.path.join(dir_name, SCHEMA_FILE_NAME)
+        if os.path.exists(path):
+            return path
+    return None
+
+def compile_ledger_columns(ws):
+    """
+    按表头解析台账各字段所在的列,每个工作表解析一次
+    返回: {'index': {字段: 行内下标}, 'column': {字段: 列号或None}, 'width': 列数,
+           'record': 从行值元组中按LEDGER_FIELDS顺序取值的itemgetter}
+    缺少的可选字段下标指向行值元组末尾补的None
+    """
+    header_row = next(ws.iter_rows(min_row=1, max_row=1, values_only=True), ())
+    positions = {}
+    for idx, value in enumerate(header_row):
+        if value is not None:
+            positions.setdefault(str(value).strip(), idx)
+    
+    headers = LEDGER_SCHEMA['headers']
+    missing = [f"{field}(表头'{headers[field]}')" for field in LEDGER_FIELDS
+               if field not in OPTIONAL_FIELDS and headers[field] not in positions]
+    if missing:
+        raise ValueError(f"{ws.title} 中找不到以下列: {', '.join(missing)}")
+    
+    width = len(header_row)
+    index = {field: positions.get(headers[field], width) for field in LEDGER_FIELDS}
+    return {
+        'index': index,
+        'column': {field: idx + 1 if idx < width else None for field, idx in index.items()},
+        'width': width,
+        'record': itemgetter(*(index[field] for field in LEDGER_FIELDS)),
+    }
+
+def improve_bond_data_table(wb, columns=None):
     """
     改进BondDataTable:
     1. 优化序号列公式
     2. 为出库日期列设置默认值公式
+    columns: compile_ledger_columns的结果,为None时按表头解析
     """
-    ws = wb['BondDataSheet']
+    ws = wb[LEDGER_SCHEMA['data_sheet']]
+    table_name = LEDGER_SCHEMA['data_table']
+    headers = LEDGER_SCHEMA['headers']
+    if columns is None:
+        columns = compile_ledger_columns(ws)
+    columns = columns['column']
     
     # 获取表格对象
-    table = ws.tables['BondDataTable']
+    table = ws.tables[table_name]
+    
+    print(f"正在改进{table_name}...")
     
-    print("正在改进BondDataTable...")
+    seq_formula = f'=ROW({table_name}[[#This Row],[{headers["序号"]}]])-1'
+    net_weight_formula = (f'={table_name}[[#This Row],[{headers["毛重"]}]]'
+                          f'-{table_name}[[#This Row],[{headers["除皮"]}]]')
     
     # 遍历数据行,设置公式
     for row_idx in range(2, ws.max_row + 1):
-        # 序号列(A列) - 保持原有公式
-        seq_cell = ws.cell(row_idx, 1)
-        if seq_cell.value is None or (isinstance(seq_cell.value, str) and seq_cell.value.startswith('=')):
-            seq_cell.value = f'=ROW(BondDataTable[[#This Row],[序号]])-1'
+        # 序号列 - 保持原有公式
+        if columns['序号']:
+            seq_cell = ws.cell(row_idx, columns['序号'])
+            if seq_cell.value is None or (isinstance(seq_cell.value, str) and seq_cell.value.startswith('=')):
+                seq_cell.value = seq_formula
         
-        # 出库日期列(B列) - 如果为空,自动填充今天日期
-        date_cell = ws.cell(row_idx, 2)
+        # 出库日期列 - 如果为空,自动填充今天日期
+        date_cell = ws.cell(row_idx, columns['出库日期'])
         if date_cell.value is None:
             date_cell.value = date.today()
             date_cell.number_format = 'YYYY-MM-DD'
         elif isinstance(date_cell.value, datetime):
             date_cell.number_format = 'YYYY-MM-DD'
         
-        # 净重列(G列) - 确保公式正确
-        net_weight_cell = ws.cell(row_idx, 7)
+        # 净重列 - 确保公式正确
+        net_weight_cell = ws.cell(row_idx, columns['净重'])
         if net_weight_cell.value is None or (isinstance(net_weight_cell.value, str) and net_weight_cell.value.startswith('=')):
-            net_weight_cell.value = f'=BondDataTable[[#This Row],[毛重]]-BondDataTable[[#This Row],[除皮]]'
+            net_weight_cell.value = net_weight_formula
     
-    print("✓ BondDataTable改进完成")
+    print(f"✓ {table_name}改进完成")
     return ws
 
-def read_bond_data(ws):
+def read_bond_data(ws, fill_defaults=False, issues=None, columns=None):
     """
     从BondDataSheet读取数据
+    fill_defaults: 按improve_bond_data_table的规则补全空白日期和净重,
+                   用于只读加载(未经过改进步骤)的工作表
+    issues: 传入列表时,读取的同时检查未入账数据,问题追加到该列表(见check_record)
+    columns: compile_ledger_columns的结果,为None时按表头解析
     返回: 数据列表,每行为一个字典
     """
-    data = []
+    return list(iter_bond_data(ws, fill_defaults, issues, columns))
+
+def iter_bond_data(ws, fill_defaults=False, issues=None, columns=None):
+    """
+    逐行读取BondDataSheet数据(生成器),配合只读加载时内存占用与行数无关
+    """
+    today = date.today()
+    seen = {}  # 重复行检查: 行内容 -> 首次出现的行号
     
-    # 从第2行开始读取(第1行是表头)
-    for row_idx in range(2, ws.max_row + 1):
+    if columns is None:
+        columns = compile_ledger_columns(ws)
+    get_record = columns['record']
+    net_weight_idx = columns['index']['净重']
+    padding = (None,)  # 缺少的可选字段取到这个None
+    
+    # 从第2行开始读取(第1行是表头),按行迭代,普通模式和只读模式均适用
+    for row_idx, cells in enumerate(ws.iter_rows(min_row=2, max_col=columns['width']), start=2):
+        row_data = dict(zip(LEDGER_FIELDS, get_record(tuple(cell.value for cell in cells) + padding)))
+        row_data['row_idx'] = row_idx  # 记录行号,用于后续标记
+        
         # 读取净重单元格,如果是公式则计算值
-        net_weight_cell = ws.cell(row_idx, 7)
-        if net_weight_cell.data_type == 'f':  # 如果是公式
+        net_weight_cell = cells[net_weight_idx]
+        net_weight_failed = False
+        if net_weight_cell.data_type == 'f' or (fill_defaults and net_weight_cell.value is None):
             # 尝试获取计算后的值
             try:
-                net_weight = float(ws.cell(row_idx, 5).value) - float(ws.cell(row_idx, 6).value)
+                row_data['净重'] = float(row_data['毛重']) - float(row_data['除皮'])
             except:
-                net_weight = 0.0
-        else:
-            net_weight = net_weight_cell.value
-        
-        row_data = {
-            '序号': ws.cell(row_idx, 1).value,
-            '出库日期': ws.cell(row_idx, 2).value,
-            '规格': ws.cell(row_idx, 3).value,
-            '个数': ws.cell(row_idx, 4).value,
-            '毛重': ws.cell(row_idx, 5).value,
-            '除皮': ws.cell(row_idx, 6).value,
-            '净重': net_weight,
-            '出库对象': ws.cell(row_idx, 8).value,
-            '入账': ws.cell(row_idx, 9).value,
-            '备注': ws.cell(row_idx, 10).value,
-            'row_idx': row_idx  # 记录行号,用于后续标记
-        }
+                row_data['净重'] = 0.0
+                net_weight_failed = True
+        
+        if fill_defaults and row_data['出库日期'] is None:
+            row_data['出库日期'] = today
         
         # 跳过空行
         if row_data['出库日期'] is None or row_data['出库对象'] is None:
@@ -92,10 +233,430 @@ def read_bond_data(ws):
         if isinstance(row_data['出库日期'], datetime):
             row_data['出库日期'] = row_data['出库日期'].date()
         
-        data.append(row_data)
+        if issues is not None:
+            check_record(row_data, net_weight_failed, seen, issues)
+        
+        yield row_data
+
+def check_record(row, net_weight_failed, seen, issues):
+    """
+    检查一条记录,问题以 {'row': 行号, 'type': 问题类型, 'message': 说明} 追加到issues
+    只检查未入账(将要生成销售清单)的记录; 重复行与之前所有记录比较
+    seen: 行内容 -> 首次出现的行号,同一次读取中共用
+    """
+    row_idx = row['row_idx']
+    key = (row['出库日期'], row['规格'], row['个数'], row['毛重'], row['除皮'], row['出库对象'])
+    first_row = seen.setdefault(key, row_idx)
+    
+    if row['入账'] == '是':
+        return
+    
+    def add(issue_type, message):
+        issues.append({'row': row_idx, 'type': issue_type, 'message': message})
+    
+    if not isinstance(row['出库日期'], date):
+        add('日期无效', f"出库日期不是日期: {row['出库日期']!r}")
+    
+    if row['规格'] is None or (isinstance(row['规格'], str) and not row['规格'].strip()):
+        add('缺少规格', "规格为空")
+    
+    gross = _to_float(row['毛重'])
+    tare = _to_float(row['除皮'])
+    if net_weight_failed:
+        add('重量无效', f"毛重/除皮无法计算净重: {row['毛重']!r} / {row['除皮']!r}")
+    elif gross is not None and tare is not None and tare > gross:
+        add('除皮大于毛重', f"除皮 {tare} 大于毛重 {gross}")
+    else:
+        net_weight = _to_float(row['净重'])
+        if net_weight is None and row['净重'] not in (None, ''):
+            add('重量无效', f"净重不是数值: {row['净重']!r}")
+        elif net_weight is not None and net_weight < 0:
+            add('净重为负', f"净重 {net_weight}")
+    
+    if first_row != row_idx:
+        add('重复行', f"与第{first_row}行内容相同")
+
+def write_validation_report(wb, issues):
+    """
+    把数据检查结果写入VALIDATION_SHEET_NAME工作表(已存在则替换,没有问题时删除)
+    """
+    if VALIDATION_SHEET_NAME in wb.sheetnames:
+        wb.remove(wb[VALIDATION_SHEET_NAME])
+    if not issues:
+        return None
+    
+    report_ws = wb.create_sheet(title=VALIDATION_SHEET_NAME, index=1)
+    report_ws.column_dimensions['A'].width = 8
+    report_ws.column_dimensions['B'].width = 14
+    report_ws.column_dimensions['C'].width = 60
+    report_ws.append(['行号', '问题类型', '说明'])
+    for cell in report_ws[1]:
+        cell.font = Font(bold=True)
+    for issue in issues:
+        report_ws.append([issue['row'], issue['type'], issue['message']])
+    return report_ws
+
+VALIDATION_REPORT_COLUMNS = [('行号', 'int'), ('问题类型', 'str'), ('说明', 'str')]
+
+def validation_report_file(output_file):
+    """因数据问题停止时的检查报告: <输出文件名>_数据检查.csv"""
+    stem, _ = os.path.splitext(output_file)
+    return f"{stem}_{VALIDATION_SHEET_NAME}.csv"
+
+def report_issues(issues, max_issues=None, report_file=None):
+    """
+    打印数据检查结果; 问题数超过max_issues时抛出ValueError,停止生成销售清单
+    report_file: 停止时先把全部问题写入该CSV文件(输出文件没有保存,看不到检查工作表);
+                 没有超过上限时删除之前停止时留下的报告
+    """
+    stopped = max_issues is not None and len(issues) > max_issues
+    if report_file and not stopped and os.path.exists(report_file):
+        os.remove(report_file)
+    
+    if not issues:
+        print("✓ 数据检查通过")
+        return
+    
+    counts = defaultdict(int)
+    for issue in issues:
+        counts[issue['type']] += 1
+    summary = ", ".join(f"{issue_type} {count}条" for issue_type, count in counts.items())
+    print(f"⚠ 数据检查发现 {len(issues)} 个问题: {summary}")
+    for issue in issues[:10]:
+        print(f"  第{issue['row']}行 [{issue['type']}] {issue['message']}")
+    if len(issues) > 10 and not stopped:
+        print(f"  ... 其余 {len(issues) - 10} 个问题见'{VALIDATION_SHEET_NAME}'工作表")
+    
+    if stopped:
+        message = f"数据检查发现 {len(issues)} 个问题,超过上限 {max_issues},已停止生成销售清单"
+        if report_file:
+            write_csv(([issue['row'], issue['type'], issue['message']] for issue in issues),
+                      VALIDATION_REPORT_COLUMNS, report_file)
+            message += f",全部问题见: {report_file}"
+        raise ValueError(message)
+
+def _lock_is_stale(lock_file):
+    """锁文件长时间未刷新,或持有进程在本机已不存在时视为过期"""
+    try:
+        age = time.time() - os.path.getmtime(lock_file)
+    except OSError:
+        return False
+    # 先看修改时间: 创建后还没写入内容就异常退出留下的空锁文件也会过期
+    if age > LOCK_STALE_SECONDS:
+        return True
+    
+    try:
+        with open(lock_file, 'r', encoding='utf-8') as f:
+            owner = json.load(f)
+    except (OSError, ValueError):
+        # 刚创建还没写完内容的锁文件不算过期
+        return False
+    
+    if owner.get('host') == socket.gethostname() and os.name == 'posix':
+        try:
+            os.kill(owner.get('pid'), 0)
+        except ProcessLookupError:
+            return True
+        except (OSError, TypeError):
+            pass
+    return False
+
+def _read_lock_owner(lock_file):
+    try:
+        with open(lock_file, 'r', encoding='utf-8') as f:
+            owner = json.load(f)
+        return f"{owner.get('host')} (PID {owner.get('pid')}, 开始于 {owner.get('time')})"
+    except (OSError, ValueError):
+        return "未知"
+
+def _remove_stale_lock(lock_file):
+    """
+    清除过期的锁文件: 先改名为本进程专用的名称再检查和删除,
+    避免两个等待者同时判断过期时,后一个删掉前一个刚创建的新锁
+    返回: 是否清除了过期锁
+    """
+    claimed = f"{lock_file}.{socket.gethostname()}.{os.getpid()}.{threading.get_ident()}.stale"
+    try:
+        os.rename(lock_file, claimed)
+    except OSError:
+        return False  # 已被其他等待者处理
+    
+    try:
+        if _lock_is_stale(claimed):
+            print(f"  清除过期的锁文件: {_read_lock_owner(claimed)}")
+            return True
+        # 改名的是别人刚创建的新锁: 放回原处(已有人重新加锁时不覆盖)
+        try:
+            os.link(claimed, lock_file)
+        except FileExistsError:
+            pass
+        except OSError:
+            # 不支持硬链接的文件系统
+            if not os.path.exists(lock_file):
+                os.rename(claimed, lock_file)
+        return False
+    finally:
+        try:
+            os.remove(claimed)
+        except OSError:
+            pass
+
+@contextmanager
+def ledger_lock(path, timeout=LOCK_WAIT_TIMEOUT):
+    """
+    共用台账的建议锁: 在文件旁创建<文件名>.lock,记录主机、PID和时间
+    其他用户正在处理时排队等待; 持有者异常退出留下的过期锁会被自动清除
+    """
+    lock_file = os.path.abspath(path) + '.lock'
+    owner = {
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+        'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    
+    start = time.time()
+    last_notice = None
+    while True:
+        try:
+            fd = os.open(lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if _lock_is_stale(lock_file) and _remove_stale_lock(lock_file):
+                continue
+            
+            waited = time.time() - start
+            if timeout is not None and waited > timeout:
+                raise TimeoutError(f"等待超时: {os.path.basename(path)} 正在被 {_read_lock_owner(lock_file)} 处理")
+            if last_notice is None or time.time() - last_notice >= 10:
+                print(f"  {os.path.basename(path)} 正在被 {_read_lock_owner(lock_file)} 处理,等待中...")
+                last_notice = time.time()
+            time.sleep(1)
+            continue
+        
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(owner, f, ensure_ascii=False)
+        break
+    
+    # 持有期间定期刷新锁文件修改时间,避免长时间运行被误判为过期
+    stop = threading.Event()
+    
+    def heartbeat():
+        while not stop.wait(LOCK_HEARTBEAT_SECONDS):
+            try:
+                os.utime(lock_file)
+            except OSError:
+                pass
+    
+    thread = threading.Thread(target=heartbeat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+        try:
+            os.remove(lock_file)
+        except OSError:
+            pass
+
+@contextmanager
+def ledger_locks(*paths):
+    """
+    同时锁定输入和输出文件: 按固定顺序加锁避免互相等待,同一文件只锁一次
+    输出文件单独时也要锁定,否则排队的第二个人会用同样的输入覆盖前一个人的输出
+    """
+    with ExitStack() as stack:
+        for path in sorted({os.path.abspath(path) for path in paths}):
+            stack.enter_context(ledger_lock(path))
+        yield
+
+def save_workbook_atomic(wb, path):
+    """
+    先保存到同目录的临时文件再替换目标文件,保存中断时不会留下损坏的文件
+    """
+    dir_name, base_name = os.path.split(os.path.abspath(path))
+    tmp_file = os.path.join(dir_name, f"~{base_name}.{os.getpid()}.tmp")
+    try:
+        wb.save(tmp_file)
+        os.replace(tmp_file, path)
+    except PermissionError:
+        raise PermissionError(f"无法写入 {path},请确认文件没有在Excel中打开")
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+def _cache_dir():
+    """
+    缓存目录: 当前用户的本地目录(Windows为%LOCALAPPDATA%,其他系统为~/.cache)下的CACHE_DIR_NAME
+    缓存用pickle保存,加载时可以执行代码,所以不能放在其他人也能写入的共享台账目录中
+    """
+    path = os.environ.get(CACHE_DIR_ENV)
+    if path:
+        return path
+    base = (os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME')
+            or os.path.join(os.path.expanduser('~'), '.cache'))
+    return os.path.join(base, CACHE_DIR_NAME)
+
+def _load_cache_index(cache_dir):
+    index_file = os.path.join(cache_dir, 'index.json')
+    try:
+        with open(index_file, 'r', encoding='utf-8') as f:
+            index = json.load(f)
+        if index.get('version') == CACHE_VERSION:
+            return index
+    except (OSError, ValueError):
+        pass
+    return {'version': CACHE_VERSION, 'entries': {}}
+
+def _save_cache_index(cache_dir, index):
+    index_file = os.path.join(cache_dir, 'index.json')
+    tmp_file = index_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_file, index_file)
+
+def _file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _cache_key(path, index, filled=True):
+    """
+    计算缓存键: 文件内容哈希 + 台账结构 + 当天日期 + 是否补全
+    (空白出库日期按当天补全,所以隔天的缓存不能复用;
+     跳过normalize阶段时读到的是未补全的数据,与补全后的数据分开缓存)
+    文件大小和修改时间与索引一致时直接复用已记录的哈希,避免重复读文件
+    """
+    abs_path = os.path.abspath(path)
+    stat = os.stat(abs_path)
+    today = date.today().isoformat()
+    schema = hashlib.sha256(json.dumps(LEDGER_SCHEMA, sort_keys=True).encode('utf-8')).hexdigest()[:8]
+    
+    for key, entry in index['entries'].items():
+        if (entry['path'] == abs_path and entry['size'] == stat.st_size
+                and entry['mtime_ns'] == stat.st_mtime_ns and entry['day'] == today
+                and entry.get('schema') == schema and entry.get('filled', True) == filled):
+            return key, entry
+    
+    key = f"{_file_sha256(abs_path)[:32]}-{schema}-{today}" + ('' if filled else '-raw')
+    entry = {
+        'path': abs_path,
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'day': today,
+        'schema': schema,
+        'filled': filled,
+        'last_used': 0.0,
+    }
+    return key, entry
+
+def ledger_cache_get(path, issues=None, filled=True, lookup=None):
+    """
+    按文件大小/修改时间/内容哈希查找已解析的BondDataSheet记录
+    issues: 传入列表时,追加读取时记录的数据检查结果
+    filled: 查找补全了空白日期和净重的数据(经过normalize或fill_defaults),为False时查找原样读取的数据
+    lookup: 传入字典时记录本次计算的缓存键,未命中后交给ledger_cache_put,不再重新计算文件哈希
+    返回: 数据列表; 未命中返回None
+    """
+    cache_dir = _cache_dir()
+    index = _load_cache_index(cache_dir)
+    key, entry = _cache_key(path, index, filled)
+    if lookup is not None:
+        lookup.update(key=key, entry=entry)
+    
+    try:
+        with open(os.path.join(cache_dir, f'{key}.pkl'), 'rb') as f:
+            payload = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        return None
+    if payload.get('version') != CACHE_VERSION:
+        return None
+    
+    # 同内容文件被复制或touch过时,更新索引中的路径和时间戳
+    entry.update(path=os.path.abspath(path), mtime_ns=os.stat(path).st_mtime_ns,
+                 last_used=time.time())
+    index['entries'][key] = entry
+    try:
+        _save_cache_index(cache_dir, index)
+    except OSError:
+        pass
+    if issues is not None:
+        issues.extend(payload['issues'])
+    return payload['data']
+
+def ledger_cache_put(path, data, issues=(), max_entries=CACHE_MAX_ENTRIES, filled=True, lookup=None):
+    """
+    保存已解析的BondDataSheet记录(及读取时的数据检查结果),
+    超过max_entries时淘汰最近最少使用的条目
+    filled: 同ledger_cache_get
+    lookup: ledger_cache_get记录的缓存键,有则直接使用
+    """
+    cache_dir = _cache_dir()
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        index = _load_cache_index(cache_dir)
+        if lookup:
+            key, entry = lookup['key'], lookup['entry']
+        else:
+            key, entry = _cache_key(path, index, filled)
+        
+        tmp_file = os.path.join(cache_dir, f'{key}.pkl.tmp')
+        with open(tmp_file, 'wb') as f:
+            pickle.dump({'version': CACHE_VERSION, 'data': data, 'issues': list(issues)}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_file, os.path.join(cache_dir, f'{key}.pkl'))
+        
+        entry['last_used'] = time.time()
+        index['entries'][key] = entry
+        
+        # LRU淘汰
+        by_age = sorted(index['entries'], key=lambda k: index['entries'][k]['last_used'])
+        for old_key in by_age[:max(0, len(by_age) - max_entries)]:
+            del index['entries'][old_key]
+            try:
+                os.remove(os.path.join(cache_dir, f'{old_key}.pkl'))
+            except OSError:
+                pass
+        
+        _save_cache_index(cache_dir, index)
+    except OSError as e:
+        # 缓存只是加速手段,写入失败不影响主流程
+        print(f"  (缓存写入失败,已忽略: {e})")
+
+def load_bond_data(path, use_cache=True, issues=None):
+    """
+    以只读方式读取文件中的BondDataSheet记录(不修改工作簿)
+    命中缓存时完全跳过xlsx解析
+    issues: 传入列表时追加数据检查结果
+    """
+    lookup = {}
+    if use_cache:
+        data = ledger_cache_get(path, issues, lookup=lookup)
+        if data is not None:
+            return data
+    
+    found = []
+    wb = openpyxl.load_workbook(path, read_only=True)
+    try:
+        data = read_bond_data(wb[LEDGER_SCHEMA['data_sheet']], fill_defaults=True, issues=found)
+    finally:
+        wb.close()
     
+    if use_cache:
+        ledger_cache_put(path, data, found, lookup=lookup)
+    if issues is not None:
+        issues.extend(found)
     return data
 
+def can_invoice(row):
+    """
+    未入账且可以开单的记录: 出库日期无效或净重不是数值(空白按0计)的行无法开单,留在数据检查报告中
+    """
+    if row['入账'] == '是' or not isinstance(row['出库日期'], date):
+        return False
+    return row['净重'] in (None, '') or _to_float(row['净重']) is not None
+
 def group_data_by_date_and_customer(data):
     """
     按出库日期和出库对象分组
@@ -104,8 +665,8 @@ def group_data_by_date_and_customer(data):
     grouped = defaultdict(list)
     
     for row in data:
-        # 只处理未入账的数据
-        if row['入账'] != '是':
+        # 只处理未入账且可以开单的数据(见can_invoice)
+        if can_invoice(row):
             key = (row['出库日期'], row['出库对象'])
             grouped[key].append(row)
     
@@ -120,7 +681,7 @@ def group_by_product(items):
     
     for item in items:
         spec = item['规格']
-        net_weight = float(item['净重']) if item['净重'] else 0.0
+        net_weight = _to_float(item['净重']) or 0.0
         
         products[spec]['件数'] += 1
         products[spec]['净重列表'].append(net_weight)
@@ -128,60 +689,312 @@ def group_by_product(items):
     
     return products
 
-def create_simple_invoice(wb, date_str, customer, items, invoice_no):
+def read_price_rows(ws):
+    """
+    从价格表工作表读取价格行,按表头名称定位列(见PRICE_HEADERS)
+    返回: [(客户, 规格, 生效日期, 单价)]
+    """
+    rows = ws.iter_rows(values_only=True)
+    header = [str(v).strip() if v is not None else None for v in next(rows, ())]
+    missing = [name for name in PRICE_HEADERS if name not in header]
+    if missing:
+        raise ValueError(f"价格表缺少列: {', '.join(missing)}")
+    columns = [header.index(name) for name in PRICE_HEADERS]
+    
+    price_rows = []
+    for values in rows:
+        values = list(values) + [None] * (len(header) - len(values))
+        price_rows.append(tuple(values[col] for col in columns))
+    return price_rows
+
+def load_price_file(path):
+    """
+    读取独立的价格表文件(.xlsx取第一个工作表或PriceSheet, .csv需包含PRICE_HEADERS表头)
+    返回: [(客户, 规格, 生效日期, 单价)]
+    """
+    if path.lower().endswith('.csv'):
+        import csv
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            reader = csv.DictReader(f)
+            missing = [name for name in PRICE_HEADERS if name not in (reader.fieldnames or [])]
+            if missing:
+                raise ValueError(f"价格表缺少列: {', '.join(missing)}")
+            return [tuple(row[name] for name in PRICE_HEADERS) for row in reader]
+    
+    wb = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        ws = wb[PRICE_SHEET_NAME] if PRICE_SHEET_NAME in wb.sheetnames else wb.worksheets[0]
+        return read_price_rows(ws)
+    finally:
+        wb.close()
+
+def _parse_price_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str) and value.strip():
+        return datetime.strptime(value.strip(), '%Y-%m-%d').date()
+    return date.min  # 未填写生效日期视为一直有效
+
+def build_price_index(price_rows):
+    """
+    构建价格索引: {(客户, 规格): ([生效日期...], [单价...])},日期升序
+    客户为空的价格存为(None, 规格),作为所有客户的默认价格
+    """
+    entries = defaultdict(list)
+    for customer, spec, effective, price in price_rows:
+        if spec is None or price is None or price == '':
+            continue
+        customer = str(customer).strip() if customer not in (None, '') else None
+        entries[(customer, str(spec).strip())].append((_parse_price_date(effective), float(price)))
+    
+    index = {}
+    for key, items in entries.items():
+        items.sort(key=lambda item: item[0])
+        index[key] = ([d for d, _ in items], [p for _, p in items])
+    return index
+
+def lookup_price(price_index, customer, spec, on_date):
+    """
+    按出库日期查找当时有效的单价(生效日期<=出库日期中最近的一条)
+    先查客户专属价格,再查默认价格; 找不到返回None
+    """
+    if spec is None:
+        return None
+    spec = str(spec).strip()
+    for key in ((str(customer).strip(), spec), (None, spec)):
+        found = price_index.get(key)
+        if found is None:
+            continue
+        dates, prices = found
+        pos = bisect.bisect_right(dates, on_date)
+        if pos:
+            return prices[pos - 1]
+    return None
+
+def workbook_price_index(wb):
+    """工作簿中有PRICE_SHEET_NAME工作表时从中构建价格索引,否则返回None"""
+    if PRICE_SHEET_NAME not in wb.sheetnames:
+        return None
+    price_index = build_price_index(read_price_rows(wb[PRICE_SHEET_NAME]))
+    print(f"  ✓ 已加载价格表: {len(price_index)}个客户/规格")
+    return price_index
+
+def price_products(products, price_index, customer, on_date):
+    """
+    为一组产品查找单价并计算金额
+    返回: {规格: (单价, 金额)},没有价格的规格不在结果中
+    """
+    if not price_index:
+        return {}
+    priced = {}
+    for spec, info in products.items():
+        unit_price = lookup_price(price_index, customer, spec, on_date)
+        if unit_price is not None:
+            priced[spec] = (unit_price, round_money(unit_price * round(info['总净重'], 2)))
+    return priced
+
+def round_money(value):
+    """金额四舍五入到分"""
+    return float(Decimal(str(value)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+
+def amount_in_words(amount):
+    """
+    金额转换为中文大写,例如 1234.5 -> 壹仟贰佰叁拾肆元伍角整
+    """
+    digits = '零壹贰叁肆伍陆柒捌玖'
+    units = ('', '拾', '佰', '仟')
+    section_units = ('', '万', '亿', '万亿')
+    
+    fen_total = int(Decimal(str(abs(amount))).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP) * 100)
+    yuan, rest = divmod(fen_total, 100)
+    jiao, fen = divmod(rest, 10)
+    
+    def section_words(n):
+        words = ''
+        zero = False
+        for i in range(3, -1, -1):
+            d = n // 10 ** i % 10
+            if d == 0:
+                zero = bool(words)
+            else:
+                if zero:
+                    words += '零'
+                    zero = False
+                words += digits[d] + units[i]
+        return words
+    
+    sections = []
+    while yuan:
+        yuan, section = divmod(yuan, 10000)
+        sections.append(section)
+    
+    words = ''
+    need_zero = False
+    for idx in range(len(sections) - 1, -1, -1):
+        section = sections[idx]
+        if section == 0:
+            need_zero = bool(words)
+            continue
+        if words and (need_zero or section < 1000):
+            words += '零'
+        words += section_words(section) + section_units[idx]
+        need_zero = False
+    
+    if words:
+        words += '元'
+    if jiao:
+        words += digits[jiao] + '角'
+    elif words and fen:
+        words += '零'
+    if fen:
+        words += digits[fen] + '分'
+    else:
+        words = (words or '零元') + '整'
+    
+    return ('负' if amount < 0 else '') + words
+
+def _invoice_date(date_str):
+    return datetime.strptime(date_str, '%Y-%m-%d').date()
+
+def invoice_sheet_name(customer, date_str, invoice_no, variant):
+    """
+    销售清单工作表名称, variant为'简单版'或'详细版'
+    """
+    sheet_name = f"销货清单_{customer}_{date_str}_{invoice_no}_{variant}"
+    return sheet_name[:31]  # Excel工作表名称限制31字符
+
+# 一张销售清单的内容,由build_invoice_model计算一次,各种版式(简单版/详细版/HTML)共用
+# lines中每个规格一行; 没有价格时unit_price和amount为"",total_amount为None
+InvoiceLine = namedtuple('InvoiceLine', 'spec pieces weight unit_price amount details')
+InvoiceModel = namedtuple('InvoiceModel',
+                          'invoice_no date_str customer lines total_pieces total_weight total_amount rows')
+
+def build_invoice_model(date_str, customer, items, invoice_no, price_index=None):
+    """
+    计算一组数据的销售清单内容: 按规格汇总件数和重量,查找单价,
+    预先格式化明细净重(固定两位小数)
+    """
+    products = group_by_product(items)
+    priced = price_products(products, price_index, customer, _invoice_date(date_str))
+    
+    lines = []
+    total_weight = 0.0
+    for spec, info in products.items():
+        unit_price, amount = priced.get(spec, ("", ""))
+        lines.append(InvoiceLine(
+            spec=spec,
+            pieces=info['件数'],
+            weight=round(info['总净重'], 2),
+            unit_price=unit_price,
+            amount=amount,
+            details=", ".join(['%.2f' % w for w in info['净重列表']]),
+        ))
+        total_weight += info['总净重']
+    
+    # 合计金额只有全部规格都有价格时才计算,否则留空手动填写
+    total_amount = None
+    if products and len(priced) == len(products):
+        total_amount = round_money(sum(amount for _, amount in priced.values()))
+    
+    return InvoiceModel(
+        invoice_no=invoice_no,
+        date_str=date_str,
+        customer=customer,
+        lines=lines,
+        total_pieces=len(items),
+        total_weight=round(total_weight, 2),
+        total_amount=total_amount,
+        rows=[item['row_idx'] for item in items],
+    )
+
+def build_invoice_models(data, price_index=None, first_invoice_no=1, invoice_numbers=None,
+                         include_recorded=False):
+    """
+    按generate_invoices的分组和单号规则计算全部未入账数据的InvoiceModel
+    结果可以缓存,或交给generate_invoices/write_invoices_html直接渲染
+    invoice_numbers: {(日期字符串, 客户): 单号},这些分组沿用原单号,其余分组从first_invoice_no开始编号
+    include_recorded: 沿用原单号的分组包含该日期该客户的全部记录(含已入账的,用于原位覆盖)
+    """
+    grouped = group_data_by_date_and_customer(data)
+    invoice_numbers = invoice_numbers or {}
+    
+    all_items = defaultdict(list)
+    if include_recorded and invoice_numbers:
+        for row in data:
+            if row['入账'] == '是' or can_invoice(row):
+                all_items[(row['出库日期'], row['出库对象'])].append(row)
+    
+    models = []
+    invoice_counter = first_invoice_no
+    for (date_obj, customer), items in grouped.items():
+        date_str = date_obj.strftime('%Y-%m-%d')
+        invoice_no = invoice_numbers.get((date_str, str(customer)))
+        if invoice_no is None:
+            invoice_no = f"{invoice_counter:05d}"
+            invoice_counter += 1
+        elif include_recorded:
+            items = all_items[(date_obj, customer)]
+        models.append(build_invoice_model(date_str, customer, items, invoice_no, price_index))
+    return models
+
+def create_invoice_sheets(wb, model, variants=INVOICE_VARIANTS):
+    """
+    用同一个InvoiceModel创建指定版式的销售清单
+    返回: 与variants顺序对应的工作表列表
+    """
+    renderers = {'简单版': create_simple_invoice, '详细版': create_detailed_invoice}
+    return [renderers[variant](wb, model) for variant in variants]
+
+def create_simple_invoice(wb, model):
     """
     创建简单版销售清单(基于TemplateSheet)
+    model: build_invoice_model的结果
     """
     # 复制模板
-    template_ws = wb['TemplateSheet']
-    sheet_name = f"销货清单_{customer}_{date_str}_{invoice_no}_简单版"
+    template_ws = wb[LEDGER_SCHEMA['template_sheet']]
     
     # 创建新工作表
     new_ws = wb.copy_worksheet(template_ws)
-    new_ws.title = sheet_name[:31]  # Excel工作表名称限制31字符
+    new_ws.title = invoice_sheet_name(model.customer, model.date_str, model.invoice_no, '简单版')
     
     # 填充数据
     # 客户名称 (C3)
-    new_ws['B3'] = f"客户: {customer}"
+    new_ws['B3'] = f"客户: {model.customer}"
     
     # 开单日期 (F3)
-    new_ws['F3'] = f" 开单日期: {date_str}"
+    new_ws['F3'] = f" 开单日期: {model.date_str}"
     
     # 单号 (I2)
-    new_ws['I2'] = f"NO {invoice_no}"
-    
-    # 按产品分组
-    products = group_by_product(items)
+    new_ws['I2'] = f"NO {model.invoice_no}"
     
     # 填充产品明细 (从第5行开始)
     row_idx = 5
-    total_amount = 0.0
     
-    for spec, info in products.items():
-        new_ws.cell(row_idx, 1).value = spec  # 产品名称
-        new_ws.cell(row_idx, 2).value = info['件数']  # 件数
-        new_ws.cell(row_idx, 3).value = round(info['总净重'], 2)  # 总重量
-        # 单价和金额需要手动填写
-        new_ws.cell(row_idx, 4).value = ""  # 单价
-        new_ws.cell(row_idx, 5).value = ""  # 金额
+    for line in model.lines:
+        new_ws.cell(row_idx, 1).value = line.spec  # 产品名称
+        new_ws.cell(row_idx, 2).value = line.pieces  # 件数
+        new_ws.cell(row_idx, 3).value = line.weight  # 总重量
+        # 单价和金额: 价格表中没有的需要手动填写
+        new_ws.cell(row_idx, 4).value = line.unit_price  # 单价
+        new_ws.cell(row_idx, 5).value = line.amount  # 金额
         
         # 明细净重
-        detail_str = ", ".join([str(round(w, 2)) for w in info['净重列表']])
-        new_ws.cell(row_idx, 6).value = f"明细净重(kg): {detail_str}"
+        new_ws.cell(row_idx, 6).value = f"明细净重(kg): {line.details}"
         
         row_idx += 1
     
     print(f"  ✓ 创建简单版销售清单: {new_ws.title}")
     return new_ws
 
-def create_detailed_invoice(wb, date_str, customer, items, invoice_no):
+def create_detailed_invoice(wb, model):
     """
     创建详细版销售清单(基于pasted_content.txt的格式)
+    model: build_invoice_model的结果
     """
-    sheet_name = f"销货清单_{customer}_{date_str}_{invoice_no}_详细版"
-    
     # 创建新工作表
-    new_ws = wb.create_sheet(title=sheet_name[:31])
+    new_ws = wb.create_sheet(title=invoice_sheet_name(model.customer, model.date_str, model.invoice_no, '详细版'))
     
     # 设置列宽
     new_ws.column_dimensions['A'].width = 20
@@ -209,7 +1022,7 @@ def create_detailed_invoice(wb, date_str, customer, items, invoice_no):
     row_idx = 1
     new_ws.merge_cells(f'A{row_idx}:E{row_idx}')
     cell = new_ws.cell(row_idx, 1)
-    cell.value = "东阳市欧亚金银丝有限公司"
+    cell.value = COMPANY_NAME
     cell.font = title_font
     cell.alignment = center_align
     
@@ -223,20 +1036,20 @@ def create_detailed_invoice(wb, date_str, customer, items, invoice_no):
     row_idx += 1
     new_ws.merge_cells(f'A{row_idx}:C{row_idx}')
     cell = new_ws.cell(row_idx, 1)
-    cell.value = f"客户: {customer}"
+    cell.value = f"客户: {model.customer}"
     cell.font = normal_font
     cell.alignment = left_align
     
     new_ws.merge_cells(f'D{row_idx}:E{row_idx}')
     cell = new_ws.cell(row_idx, 4)
-    cell.value = f"No. {invoice_no}"
+    cell.value = f"No. {model.invoice_no}"
     cell.font = normal_font
     cell.alignment = Alignment(horizontal='right', vertical='center')
     
     row_idx += 1
     new_ws.merge_cells(f'A{row_idx}:E{row_idx}')
     cell = new_ws.cell(row_idx, 1)
-    cell.value = f"开单日期: {date_str}"
+    cell.value = f"开单日期: {model.date_str}"
     cell.font = normal_font
     cell.alignment = Alignment(horizontal='right', vertical='center')
     
@@ -250,39 +1063,33 @@ def create_detailed_invoice(wb, date_str, customer, items, invoice_no):
         cell.alignment = center_align
         cell.border = thin_border
     
-    # 按产品分组
-    products = group_by_product(items)
-    
     # 填充产品明细
-    total_pieces = 0
-    total_weight = 0.0
-    
-    for spec, info in products.items():
+    for line in model.lines:
         row_idx += 1
         
         # 产品行
-        new_ws.cell(row_idx, 1).value = spec
+        new_ws.cell(row_idx, 1).value = line.spec
         new_ws.cell(row_idx, 1).font = normal_font
         new_ws.cell(row_idx, 1).alignment = center_align
         new_ws.cell(row_idx, 1).border = thin_border
         
-        new_ws.cell(row_idx, 2).value = info['件数']
+        new_ws.cell(row_idx, 2).value = line.pieces
         new_ws.cell(row_idx, 2).font = normal_font
         new_ws.cell(row_idx, 2).alignment = center_align
         new_ws.cell(row_idx, 2).border = thin_border
         
-        new_ws.cell(row_idx, 3).value = round(info['总净重'], 2)
+        new_ws.cell(row_idx, 3).value = line.weight
         new_ws.cell(row_idx, 3).font = normal_font
         new_ws.cell(row_idx, 3).alignment = center_align
         new_ws.cell(row_idx, 3).border = thin_border
         
-        # 单价和金额留空,需要手动填写
-        new_ws.cell(row_idx, 4).value = ""
+        # 单价和金额: 价格表中没有的留空,需要手动填写
+        new_ws.cell(row_idx, 4).value = line.unit_price
         new_ws.cell(row_idx, 4).font = normal_font
         new_ws.cell(row_idx, 4).alignment = center_align
         new_ws.cell(row_idx, 4).border = thin_border
         
-        new_ws.cell(row_idx, 5).value = ""
+        new_ws.cell(row_idx, 5).value = line.amount
         new_ws.cell(row_idx, 5).font = normal_font
         new_ws.cell(row_idx, 5).alignment = center_align
         new_ws.cell(row_idx, 5).border = thin_border
@@ -290,30 +1097,28 @@ def create_detailed_invoice(wb, date_str, customer, items, invoice_no):
         # 明细净重
         row_idx += 1
         new_ws.merge_cells(f'A{row_idx}:E{row_idx}')
-        detail_str = ", ".join([str(round(w, 2)) for w in info['净重列表']])
         cell = new_ws.cell(row_idx, 1)
-        cell.value = f"明细净重(kg): {detail_str}"
+        cell.value = f"明细净重(kg): {line.details}"
         cell.font = Font(name='宋体', size=10)
         cell.alignment = left_align
         cell.border = thin_border
-        
-        total_pieces += info['件数']
-        total_weight += info['总净重']
     
     # 汇总
     row_idx += 1
     new_ws.merge_cells(f'A{row_idx}:E{row_idx}')
     cell = new_ws.cell(row_idx, 1)
-    cell.value = f"汇总: 总件数 {total_pieces}箱    总重量 {round(total_weight, 2)}kg"
+    cell.value = f"汇总: 总件数 {model.total_pieces}箱    总重量 {model.total_weight}kg"
     cell.font = header_font
     cell.alignment = center_align
     cell.border = thin_border
     
-    # 金额汇总(留空)
+    # 金额汇总(只有全部规格都有价格时才填写,否则留空手动填写)
+    total_amount = model.total_amount
+    
     row_idx += 1
     new_ws.merge_cells(f'A{row_idx}:E{row_idx}')
     cell = new_ws.cell(row_idx, 1)
-    cell.value = "合计金额(大写): "
+    cell.value = "合计金额(大写): " + (amount_in_words(total_amount) if total_amount is not None else "")
     cell.font = normal_font
     cell.alignment = left_align
     cell.border = thin_border
@@ -321,7 +1126,7 @@ def create_detailed_invoice(wb, date_str, customer, items, invoice_no):
     row_idx += 1
     new_ws.merge_cells(f'A{row_idx}:E{row_idx}')
     cell = new_ws.cell(row_idx, 1)
-    cell.value = "合计金额(小写): ¥"
+    cell.value = "合计金额(小写): ¥" + (f"{total_amount:.2f}" if total_amount is not None else "")
     cell.font = normal_font
     cell.alignment = left_align
     cell.border = thin_border
@@ -330,100 +1135,1196 @@ def create_detailed_invoice(wb, date_str, customer, items, invoice_no):
     row_idx += 1
     new_ws.merge_cells(f'A{row_idx}:E{row_idx}')
     cell = new_ws.cell(row_idx, 1)
-    cell.value = "备注: 1. 建议用户试样,如有质量问题,请在3日内退回。2. 如果发生法律纠纷,由东阳市人民法院管辖。"
+    cell.value = INVOICE_REMARK
     cell.font = Font(name='宋体', size=9)
     cell.alignment = left_align
     
     row_idx += 1
     new_ws.merge_cells(f'A{row_idx}:E{row_idx}')
     cell = new_ws.cell(row_idx, 1)
-    cell.value = "手机: 18606833896, 18606886823  电话: 0579-86985290  传真: 0579-86985471"
+    cell.value = INVOICE_CONTACT
     cell.font = Font(name='宋体', size=9)
     cell.alignment = center_align
     
     print(f"  ✓ 创建详细版销售清单: {new_ws.title}")
     return new_ws
 
-def mark_as_recorded(ws, row_indices):
+# HTML销售清单模板(string.Template语法),可通过write_invoices_html的template_dir替换
+HTML_PAGE_TEMPLATE = """<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+<meta charset="utf-8">
+<title>$title</title>
+<style>
+@page { size: A4; margin: 15mm; }
+body { font-family: "宋体", SimSun, serif; font-size: 11pt; margin: 0; }
+.invoice { width: 180mm; margin: 0 auto 10mm; page-break-after: always; break-after: page; }
+.invoice:last-child { page-break-after: auto; break-after: auto; }
+h1 { font-size: 16pt; text-align: center; margin: 0 0 4pt; }
+h2 { font-size: 12pt; text-align: center; margin: 0 0 8pt; }
+.meta { display: flex; justify-content: space-between; margin: 2pt 0; }
+.date { text-align: right; margin: 2pt 0 6pt; }
+table { width: 100%; border-collapse: collapse; }
+th, td { border: 1px solid #000; padding: 3pt 4pt; text-align: center; }
+th { font-size: 12pt; }
+td.detail { text-align: left; font-size: 10pt; }
+td.total { font-size: 12pt; font-weight: bold; }
+td.amount { text-align: left; }
+.remark { font-size: 9pt; margin-top: 6pt; }
+.contact { font-size: 9pt; text-align: center; }
+@media screen { .invoice { border-bottom: 1px dashed #999; padding-bottom: 10mm; } }
+</style>
+</head>
+<body>
+$invoices
+</body>
+</html>
+"""
+
+HTML_INVOICE_TEMPLATE = """<div class="invoice">
+<h1>$company</h1>
+<h2>销货清单</h2>
+<div class="meta"><span>客户: $customer</span><span>No. $invoice_no</span></div>
+<div class="date">开单日期: $date</div>
+<table>
+<tr><th>产品名称</th><th>件数</th><th>总重量(kg)</th><th>单价(元)</th><th>金额(元)</th></tr>
+$rows
+<tr><td class="total" colspan="5">汇总: 总件数 ${total_pieces}箱&nbsp;&nbsp;&nbsp;&nbsp;总重量 ${total_weight}kg</td></tr>
+<tr><td class="amount" colspan="5">合计金额(大写): $amount_words</td></tr>
+<tr><td class="amount" colspan="5">合计金额(小写): ¥$amount</td></tr>
+</table>
+<div class="remark">$remark</div>
+<div class="contact">$contact</div>
+</div>
+"""
+
+HTML_ROW_TEMPLATE = """<tr><td>$spec</td><td>$pieces</td><td>$weight</td><td>$unit_price</td><td>$line_amount</td></tr>
+<tr><td class="detail" colspan="5">明细净重(kg): $details</td></tr>"""
+
+_html_templates = {}
+
+def _html_template(name, template_dir=None):
+    """
+    读取并编译HTML模板,编译结果按(目录, 名称)缓存,批量生成时只编译一次
+    template_dir中有同名文件(page.html/invoice.html/row.html)时优先使用
+    """
+    from string import Template
+    
+    key = (template_dir, name)
+    template = _html_templates.get(key)
+    if template is None:
+        builtin = {'page': HTML_PAGE_TEMPLATE, 'invoice': HTML_INVOICE_TEMPLATE, 'row': HTML_ROW_TEMPLATE}
+        text = builtin[name]
+        if template_dir:
+            path = os.path.join(template_dir, f'{name}.html')
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    text = f.read()
+        template = _html_templates[key] = Template(text)
+    return template
+
+def render_invoice_html(model, template_dir=None):
+    """
+    把一个InvoiceModel渲染为一张HTML销售清单(详细版的内容,不含页面外壳)
+    """
+    from html import escape
+    
+    row_template = _html_template('row', template_dir)
+    rows = [
+        row_template.substitute(
+            spec=escape(str(line.spec)),
+            pieces=line.pieces,
+            weight=line.weight,
+            unit_price=line.unit_price,
+            line_amount=line.amount,
+            details=line.details,
+        )
+        for line in model.lines
+    ]
+    
+    total_amount = model.total_amount
+    return _html_template('invoice', template_dir).substitute(
+        company=escape(COMPANY_NAME),
+        customer=escape(str(model.customer)),
+        invoice_no=escape(model.invoice_no),
+        date=model.date_str,
+        rows="\n".join(rows),
+        total_pieces=model.total_pieces,
+        total_weight=model.total_weight,
+        amount_words=amount_in_words(total_amount) if total_amount is not None else "",
+        amount=f"{total_amount:.2f}" if total_amount is not None else "",
+        remark=escape(INVOICE_REMARK),
+        contact=escape(INVOICE_CONTACT),
+    )
+
+def _safe_file_name(name):
+    """去掉文件名中不允许的字符"""
+    for ch in '\\/:*?"<>|':
+        name = name.replace(ch, '_')
+    return name
+
+def write_invoices_html(data, output_path, price_index=None, template_dir=None, models=None):
+    """
+    按generate_invoices的分组和单号规则生成可直接打印的HTML销售清单
+    output_path以.html结尾时生成一个分页的批量文件,否则视为目录,每张清单一个文件
+    models: 预先计算好的InvoiceModel列表(见prepare_invoice_models),传入时忽略data和price_index
+    返回: 生成的文件路径列表
+    """
+    print("\n正在生成HTML销售清单...")
+    
+    if models is None:
+        models = build_invoice_models(data, price_index)
+    page_template = _html_template('page', template_dir)
+    batch = output_path.lower().endswith('.html')
+    if not batch:
+        os.makedirs(output_path, exist_ok=True)
+    
+    pages = []
+    paths = []
+    for model in models:
+        page = render_invoice_html(model, template_dir)
+        
+        if batch:
+            pages.append(page)
+            continue
+        
+        path = os.path.join(output_path, _safe_file_name(
+            f"销货清单_{model.customer}_{model.date_str}_{model.invoice_no}.html"))
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(page_template.substitute(title=f"销货清单 {model.invoice_no}", invoices=page))
+        paths.append(path)
+    
+    if batch:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(page_template.substitute(title="销货清单", invoices="\n".join(pages)))
+        paths.append(output_path)
+    
+    print(f"  ✓ 共生成 {len(models)} 张HTML销售清单: {output_path}")
+    return paths
+
+def mark_as_recorded(ws, row_indices, columns=None):
     """
     在入账列标记"是"
+    columns: compile_ledger_columns的结果,为None时按表头解析
     """
+    if columns is None:
+        columns = compile_ledger_columns(ws)
+    recorded_col = columns['column']['入账']
     for row_idx in row_indices:
-        ws.cell(row_idx, 9).value = "是"
+        ws.cell(row_idx, recorded_col).value = "是"
+
+def _cell_text(ws, coord, prefix):
+    """读取以prefix开头的单元格文本,返回去掉前缀后的内容; 不匹配返回None"""
+    value = ws[coord].value
+    if isinstance(value, str) and value.startswith(prefix):
+        return value[len(prefix):].strip()
+    return None
+
+def index_invoice_sheets(wb):
+    """
+    扫描工作簿中已有的销售清单工作表
+    工作表名称可能被截断到31字符,所以从单元格内容(客户/开单日期/单号)识别
+    返回: {(日期字符串, 客户): {'invoice_no': 单号, '简单版': ws, '详细版': ws}}
+    """
+    index = {}
+    for ws in wb.worksheets:
+        if not ws.title.startswith('销货清单_'):
+            continue
+        
+        # 详细版: A3客户, A4开单日期, D3单号
+        invoice_no = _cell_text(ws, 'D3', 'No.')
+        if invoice_no is not None:
+            variant = '详细版'
+            customer = _cell_text(ws, 'A3', '客户:')
+            date_str = _cell_text(ws, 'A4', '开单日期:')
+        else:
+            # 简单版: B3客户, F3开单日期, I2单号
+            invoice_no = _cell_text(ws, 'I2', 'NO')
+            variant = '简单版'
+            customer = _cell_text(ws, 'B3', '客户:')
+            date_str = _cell_text(ws, 'F3', ' 开单日期:')
+        
+        if invoice_no is None or customer is None or date_str is None:
+            continue
+        
+        entry = index.setdefault((date_str, customer), {'invoice_no': invoice_no})
+        entry[variant] = ws
+    return index
+
+def max_invoice_no(index):
+    """index_invoice_sheets结果中最大的数字单号,没有清单时为0"""
+    return max((int(entry['invoice_no']) for entry in index.values() if entry['invoice_no'].isdigit()),
+               default=0)
 
-def generate_invoices(wb):
+def _replace_sheet(wb, old_ws, new_ws):
+    """用new_ws替换old_ws,放到old_ws原来的位置"""
+    wb.move_sheet(new_ws, offset=wb.index(old_ws) - wb.index(new_ws))
+    wb.remove(old_ws)
+
+def generate_invoices(wb, data=None, price_index=None, upsert=False, models=None,
+                      variants=INVOICE_VARIANTS, mark=True, columns=None):
     """
     生成销售清单
+    data: 已读取的BondDataSheet记录(例如来自缓存),为None时从工作簿读取
+    price_index: 价格索引,为None时如果工作簿中有PriceSheet则从中读取
+    upsert: 同一(日期, 客户)已有销售清单时,沿用原单号在原位置重新生成,
+            清单包含该日期该客户的全部记录; 新分组的单号接着已有最大单号编号
+    models: 预先计算好的InvoiceModel列表(见prepare_invoice_models),传入时按其内容和单号
+            直接生成工作表,忽略price_index
+    variants: 要生成的版式,默认简单版和详细版都生成; 覆盖已有清单时,原来已有的其他版式
+              也一起重新生成,避免同一单号的两个版式内容不一致
+    mark: 为False时只生成清单,不标记入账(由调用方另行标记)
+    columns: compile_ledger_columns的结果,为None时按表头解析
+    返回: 本次生成清单的记录列表(只含之前未入账的记录)
     """
     print("\n正在生成销售清单...")
     
-    # 读取数据
-    ws = wb['BondDataSheet']
-    data = read_bond_data(ws)
+    # 读取数据(列位置只解析一次,读取和标记入账共用)
+    ws = wb[LEDGER_SCHEMA['data_sheet']]
+    if columns is None:
+        columns = compile_ledger_columns(ws)
+    if data is None:
+        data = read_bond_data(ws, columns=columns)
     
-    # 按日期和客户分组
-    grouped = group_data_by_date_and_customer(data)
+    if models is None:
+        if not group_data_by_date_and_customer(data):
+            print("  没有需要生成销售清单的数据(所有数据都已入账)")
+            return []
+        models = prepare_invoice_models(wb, data, price_index, upsert=upsert)
     
-    if not grouped:
-        print("  没有需要生成销售清单的数据(所有数据都已入账)")
-        return
+    existing = index_invoice_sheets(wb) if upsert else {}
+    recorded_rows = set()
+    for model in models:
+        found = existing.get((model.date_str, str(model.customer)))
+        group_variants = variants
+        
+        if found:
+            # 覆盖已有清单: 要生成的版式加上原来已有的版式,先让出原工作表名称,新工作表才能使用相同名称
+            print(f"\n覆盖: {model.date_str} - {model.customer} ({len(model.rows)}条记录, 单号{model.invoice_no})")
+            group_variants = tuple(v for v in INVOICE_VARIANTS if v in variants or v in found)
+            for variant in group_variants:
+                if variant in found:
+                    found[variant].title = f"待覆盖_{variant}_{wb.index(found[variant])}"
+        else:
+            print(f"\n处理: {model.date_str} - {model.customer} ({len(model.rows)}条记录)")
+        
+        # 生成各版式,覆盖时放到原工作表的位置
+        for variant, new_ws in zip(group_variants, create_invoice_sheets(wb, model, group_variants)):
+            if found and variant in found:
+                _replace_sheet(wb, found[variant], new_ws)
+        
+        # 标记为已入账
+        if mark:
+            mark_as_recorded(ws, model.rows, columns)
+        recorded_rows.update(model.rows)
     
-    invoice_counter = 1
+    print(f"\n✓ 共生成 {len(models)} 组销售清单")
+    return [row for row in data if row['row_idx'] in recorded_rows and row['入账'] != '是']
+
+def copy_template_sheet(template_ws, target_wb, title):
+    """
+    把模板工作表复制到另一个工作簿(copy_worksheet只能在同一工作簿内复制)
+    复制单元格值和样式、合并单元格、行高列宽及页面设置
+    """
+    new_ws = target_wb.create_sheet(title=title)
     
-    for (date_obj, customer), items in grouped.items():
-        date_str = date_obj.strftime('%Y-%m-%d')
-        invoice_no = f"{invoice_counter:05d}"
+    for row in template_ws.iter_rows():
+        for cell in row:
+            new_cell = new_ws.cell(cell.row, cell.column)
+            new_cell.value = cell.value
+            if cell.has_style:
+                new_cell.font = copy.copy(cell.font)
+                new_cell.border = copy.copy(cell.border)
+                new_cell.fill = copy.copy(cell.fill)
+                new_cell.number_format = cell.number_format
+                new_cell.alignment = copy.copy(cell.alignment)
+                new_cell.protection = copy.copy(cell.protection)
+    
+    for merged in template_ws.merged_cells.ranges:
+        new_ws.merge_cells(str(merged))
+    for key, dim in template_ws.column_dimensions.items():
+        new_ws.column_dimensions[key].width = dim.width
+    for key, dim in template_ws.row_dimensions.items():
+        new_ws.row_dimensions[key].height = dim.height
+    
+    new_ws.page_setup.orientation = template_ws.page_setup.orientation
+    new_ws.page_setup.paperSize = template_ws.page_setup.paperSize
+    new_ws.page_margins = copy.copy(template_ws.page_margins)
+    new_ws.print_options = copy.copy(template_ws.print_options)
+    return new_ws
+
+def batch_file_name(output_file, batch_no):
+    """分批模式下每批销售清单的文件名: <输出文件名>_清单_001.xlsx"""
+    stem, ext = os.path.splitext(output_file)
+    return f"{stem}_清单_{batch_no:03d}{ext or '.xlsx'}"
+
+def existing_batch_files(output_file):
+    """
+    输出文件旁已有的分批文件(包括之前运行生成的)
+    返回: [(批号, 路径)],按批号排序
+    """
+    stem, ext = os.path.splitext(output_file)
+    ext = ext or '.xlsx'
+    prefix = f"{stem}_清单_"
+    found = []
+    for path in glob.glob(glob.escape(prefix) + '*' + glob.escape(ext)):
+        number = path[len(prefix):len(path) - len(ext)]
+        if number.isdigit():
+            found.append((int(number), path))
+    return sorted(found)
+
+def batch_numbering(wb, output_file, journal):
+    """
+    分批模式的下一个单号和批号: 单号接着运行日志、已有分批文件和主工作簿中的最大单号,
+    批号接着已有分批文件,不覆盖之前运行生成的文件(运行日志在保存后就删除了,不能只看日志)
+    返回: (下一个单号, 下一个批号)
+    """
+    numbers = [int(entry['invoice_no']) for entry in journal]
+    numbers.append(max_invoice_no(index_invoice_sheets(wb)))
+    
+    batch_files = existing_batch_files(output_file)
+    for _, path in batch_files:
+        batch_wb = openpyxl.load_workbook(path, read_only=True)
+        try:
+            numbers.append(max_invoice_no(index_invoice_sheets(batch_wb)))
+        finally:
+            batch_wb.close()
+    
+    return max(numbers, default=0) + 1, next_batch_no(output_file, journal, batch_files)
+
+def next_batch_no(output_file, journal, batch_files=None):
+    """下一个分批文件的批号,接着已有分批文件和运行日志中的最大批号"""
+    if batch_files is None:
+        batch_files = existing_batch_files(output_file)
+    batch_numbers = [batch_no for batch_no, _ in batch_files] + [entry['batch'] for entry in journal]
+    return max(batch_numbers, default=0) + 1
+
+def journal_file_name(output_file):
+    """分批模式的运行日志: <输出文件>.journal,每行一条已完成销售清单的JSON记录"""
+    return output_file + '.journal'
+
+def read_journal(output_file):
+    """
+    读取运行日志中已完成的销售清单
+    程序在写日志时中断可能留下不完整的最后一行,忽略即可
+    返回: 记录列表
+    """
+    entries = []
+    try:
+        with open(journal_file_name(output_file), 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    return entries
+
+def _append_journal(output_file, entries):
+    """追加已完成的销售清单记录并立即写入磁盘"""
+    with open(journal_file_name(output_file), 'a', encoding='utf-8') as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        f.flush()
+        os.fsync(f.fileno())
+
+def clear_journal(output_file):
+    """输出文件保存成功后删除运行日志"""
+    try:
+        os.remove(journal_file_name(output_file))
+    except OSError:
+        pass
+
+def completed_journal_entries(journal, output_file):
+    """
+    运行日志中上次中断前已完成且所在分批文件还在的清单
+    返回: {(日期字符串, 客户, 行号元组): 日志记录}
+    """
+    output_dir = os.path.dirname(os.path.abspath(output_file))
+    return {
+        (entry['date'], entry['customer'], tuple(entry['rows'])): entry
+        for entry in journal if os.path.exists(os.path.join(output_dir, entry['file']))
+    }
+
+def prepare_invoice_models(wb, data, price_index=None, upsert=False, output_file=None, batch_size=0,
+                           continue_numbering=False):
+    """
+    按process_ledger的单号规则计算全部InvoiceModel,工作表、HTML、导出和预览共用同一份结果:
+    - 分批模式(batch_size > 0): 运行日志中已完成的分组沿用日志中的单号,
+      其余分组接着日志、已有分批文件和工作簿中的最大单号编号(见batch_numbering)
+    - upsert: 工作簿中已有清单的分组沿用原单号并包含该日期该客户的全部记录,新分组接着最大单号编号
+    - continue_numbering(写回原文件): 不改动已有清单,全部分组接着最大单号编号
+    - 其他情况从00001开始编号
+    wb可以是只读方式打开的工作簿(预览时使用)
+    price_index: 价格索引,为None时如果工作簿中有PriceSheet则从中读取
+    """
+    if price_index is None:
+        price_index = workbook_price_index(wb)
+    
+    if batch_size > 0:
+        journal = read_journal(output_file)
+        completed = completed_journal_entries(journal, output_file)
+        first_invoice_no, _ = batch_numbering(wb, output_file, journal)
+        invoice_numbers = {}
+        for (date_obj, customer), items in group_data_by_date_and_customer(data).items():
+            date_str = date_obj.strftime('%Y-%m-%d')
+            entry = completed.get((date_str, str(customer), tuple(item['row_idx'] for item in items)))
+            if entry:
+                invoice_numbers[(date_str, str(customer))] = entry['invoice_no']
+        return build_invoice_models(data, price_index, first_invoice_no, invoice_numbers)
+    
+    if upsert or continue_numbering:
+        existing = index_invoice_sheets(wb)
+        if existing:
+            first_invoice_no = max_invoice_no(existing) + 1
+            print(f"  已有 {len(existing)} 组销售清单,新单号从 {first_invoice_no:05d} 开始")
+            if not upsert:
+                return build_invoice_models(data, price_index, first_invoice_no)
+            invoice_numbers = {key: entry['invoice_no'] for key, entry in existing.items()}
+            return build_invoice_models(data, price_index, first_invoice_no, invoice_numbers,
+                                        include_recorded=True)
+    
+    return build_invoice_models(data, price_index)
+
+def generate_invoices_batched(wb, output_file, batch_size, data=None, price_index=None,
+                              variants=INVOICE_VARIANTS, mark=True, columns=None, models=None):
+    """
+    分批生成销售清单,限制内存占用并可在中断后继续:
+    每batch_size组销售清单放在一个单独的工作簿中,保存到batch_file_name后立即释放,
+    主工作簿只保留台账和入账标记; 单号和批号接着已有的清单编号(见batch_numbering)
+    每批保存后,在运行日志(journal_file_name)中追加该批每组的单号、行号和工作表名;
+    中断后用相同的输入和输出重新运行,日志中已完成的组直接跳过(只重新标记入账)
+    variants, mark, columns: 同generate_invoices
+    models: 预先计算好的InvoiceModel列表(见prepare_invoice_models),为None时在这里计算
+    返回: 本次生成清单的记录列表(包括日志中已完成的组)
+    """
+    print(f"\n正在分批生成销售清单(每批{batch_size}组)...")
+    
+    ws = wb[LEDGER_SCHEMA['data_sheet']]
+    if columns is None:
+        columns = compile_ledger_columns(ws)
+    if data is None:
+        data = read_bond_data(ws, columns=columns)
+    
+    if models is None:
+        if not group_data_by_date_and_customer(data):
+            print("  没有需要生成销售清单的数据(所有数据都已入账)")
+            return []
+        models = prepare_invoice_models(wb, data, price_index, output_file=output_file,
+                                        batch_size=batch_size)
+    
+    # 上次中断前已完成的组: 日期、客户和行号都相同且所在文件还在
+    journal = read_journal(output_file)
+    completed = completed_journal_entries(journal, output_file)
+    batch_no = next_batch_no(output_file, journal)
+    
+    pending = []
+    for model in models:
+        if (model.date_str, str(model.customer), tuple(model.rows)) in completed:
+            if mark:
+                mark_as_recorded(ws, model.rows, columns)
+        else:
+            pending.append(model)
+    if completed:
+        print(f"  上次运行已完成 {len(models) - len(pending)} 组,继续处理其余 {len(pending)} 组")
+    
+    template_ws = wb[LEDGER_SCHEMA['template_sheet']]
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        batch_file = batch_file_name(output_file, batch_no)
+        print(f"\n第{batch_no}批: {len(batch)}组")
         
-        print(f"\n处理: {date_str} - {customer} ({len(items)}条记录)")
+        batch_wb = openpyxl.Workbook()
+        batch_wb.remove(batch_wb.active)
+        copy_template_sheet(template_ws, batch_wb, LEDGER_SCHEMA['template_sheet'])
         
-        # 生成简单版
-        create_simple_invoice(wb, date_str, customer, items, invoice_no)
+        entries = []
+        for model in batch:
+            print(f"处理: {model.date_str} - {model.customer} ({len(model.rows)}条记录)")
+            sheets = create_invoice_sheets(batch_wb, model, variants)
+            entries.append({
+                'invoice_no': model.invoice_no,
+                'date': model.date_str,
+                'customer': str(model.customer),
+                'rows': model.rows,
+                'sheets': [new_ws.title for new_ws in sheets],
+                'file': os.path.basename(batch_file),  # 与输出文件在同一目录
+                'batch': batch_no,
+            })
         
-        # 生成详细版
-        create_detailed_invoice(wb, date_str, customer, items, invoice_no)
+        batch_wb.remove(batch_wb[LEDGER_SCHEMA['template_sheet']])
+        save_workbook_atomic(batch_wb, batch_file)
+        del batch_wb
+        _append_journal(output_file, entries)
+        print(f"  ✓ 已保存: {os.path.basename(batch_file)}")
         
         # 标记为已入账
-        row_indices = [item['row_idx'] for item in items]
-        mark_as_recorded(ws, row_indices)
+        if mark:
+            for entry in entries:
+                mark_as_recorded(ws, entry['rows'], columns)
+        batch_no += 1
+    
+    print(f"\n✓ 共生成 {len(models)} 组销售清单")
+    recorded_rows = {row_idx for model in models for row_idx in model.rows}
+    return [row for row in data if row['row_idx'] in recorded_rows]
+
+def read_summary_days(wb):
+    """
+    读取SUMMARY_DATA_SHEET_NAME中保存的按天汇总数据
+    返回: {(出库日期, 客户, 规格): [件数, 净重, 金额或None]}; 没有该工作表时返回None
+    """
+    if SUMMARY_DATA_SHEET_NAME not in wb.sheetnames:
+        return None
+    
+    days = {}
+    rows = wb[SUMMARY_DATA_SHEET_NAME].iter_rows(min_row=2, max_col=len(SUMMARY_DATA_HEADERS),
+                                                 values_only=True)
+    for day, customer, spec, pieces, weight, amount in rows:
+        if day is None:
+            break
+        if isinstance(day, datetime):
+            day = day.date()
+        days[(day, customer, spec)] = [int(pieces or 0), float(weight or 0.0),
+                                       float(amount) if amount not in (None, '') else None]
+    return days
+
+def summary_day_totals(rows, price_index=None):
+    """
+    按(出库日期, 客户, 规格)汇总入账记录
+    金额按销售清单的算法: 同一天同一客户同一规格的总净重(保留两位)乘以当时的单价
+    返回: {(出库日期, 客户, 规格): [件数, 净重, 金额或None]}
+    """
+    days = {}
+    for row in rows:
+        if not isinstance(row['出库日期'], date):
+            continue
+        total = days.setdefault((row['出库日期'], row['出库对象'], row['规格']), [0, 0.0, None])
+        total[0] += 1
+        total[1] += _to_float(row['净重']) or 0.0
+    
+    if price_index:
+        for (day, customer, spec), total in days.items():
+            unit_price = lookup_price(price_index, customer, spec, day)
+            if unit_price is not None:
+                total[2] = round_money(unit_price * round(total[1], 2))
+    return days
+
+def _add_summary_total(total, pieces, weight, amount):
+    """
+    把一项汇总累加到total([件数, 净重, 金额]),与销售清单的合计金额规则相同:
+    任何一项没有金额时合计金额为None(留空),不累加部分金额
+    """
+    total[0] += pieces
+    total[1] += weight
+    total[2] = None if amount is None or total[2] is None else round_money(total[2] + amount)
+
+def summary_cube(days):
+    """把按天汇总合计为 {(月份, 客户, 规格): [件数, 净重, 金额或None]}"""
+    cube = {}
+    for (day, customer, spec), (pieces, weight, amount) in days.items():
+        _add_summary_total(cube.setdefault((day.strftime('%Y-%m'), customer, spec), [0, 0.0, 0.0]),
+                           pieces, weight, amount)
+    return cube
+
+def write_summary_days(wb, days):
+    """重写隐藏的SUMMARY_DATA_SHEET_NAME工作表(放在月度汇总之后),下次运行从这里读取"""
+    if SUMMARY_DATA_SHEET_NAME in wb.sheetnames:
+        index = wb.index(wb[SUMMARY_DATA_SHEET_NAME])
+        wb.remove(wb[SUMMARY_DATA_SHEET_NAME])
+    else:
+        index = wb.index(wb[SUMMARY_SHEET_NAME]) + 1
+    data_ws = wb.create_sheet(title=SUMMARY_DATA_SHEET_NAME, index=index)
+    data_ws.sheet_state = 'hidden'
+    
+    data_ws.append(list(SUMMARY_DATA_HEADERS))
+    for key in sorted(days, key=lambda key: tuple('' if part is None else str(part) for part in key)):
+        pieces, weight, amount = days[key]
+        data_ws.append(list(key) + [pieces, round(weight, 6), amount if amount is not None else ""])
+        data_ws.cell(data_ws.max_row, 1).number_format = 'YYYY-MM-DD'
+    return data_ws
+
+def write_summary_sheet(wb, cube):
+    """
+    重写SUMMARY_SHEET_NAME工作表:
+    A-F列为按(月份, 客户, 规格)的汇总数据,右侧为按客户和按规格的月度合计
+    """
+    if SUMMARY_SHEET_NAME in wb.sheetnames:
+        index = wb.index(wb[SUMMARY_SHEET_NAME])
+        wb.remove(wb[SUMMARY_SHEET_NAME])
+    else:
+        index = 1
+    summary_ws = wb.create_sheet(title=SUMMARY_SHEET_NAME, index=index)
+    
+    def sort_key(key):
+        return tuple('' if part is None else str(part) for part in key)
+    
+    def write_table(first_col, headers, table):
+        for col_idx, header in enumerate(headers, start=first_col):
+            cell = summary_ws.cell(1, col_idx)
+            cell.value = header
+            cell.font = Font(bold=True)
+        for row_idx, key in enumerate(sorted(table, key=sort_key), start=2):
+            pieces, weight, amount = table[key]
+            # 净重保留更多位数,累加多次后不产生舍入误差,显示为两位小数
+            values = list(key) + [pieces, round(weight, 6), amount if amount is not None else ""]
+            for col_idx, value in enumerate(values, start=first_col):
+                summary_ws.cell(row_idx, col_idx).value = value
+            summary_ws.cell(row_idx, first_col + len(key) + 1).number_format = '0.00'
+    
+    def roll_up(key_of):
+        table = {}
+        for key, (pieces, weight, amount) in cube.items():
+            _add_summary_total(table.setdefault(key_of(key), [0, 0.0, 0.0]), pieces, weight, amount)
+        return table
+    
+    write_table(1, SUMMARY_HEADERS, cube)
+    write_table(8, ('月份', '出库对象', '件数', '净重(kg)', '金额(元)'),
+                roll_up(lambda key: (key[0], key[1])))
+    write_table(14, ('月份', '规格', '件数', '净重(kg)', '金额(元)'),
+                roll_up(lambda key: (key[0], key[2])))
+    
+    for col_letter, width in (('A', 10), ('B', 16), ('C', 14), ('H', 10), ('I', 16), ('N', 10), ('O', 14)):
+        summary_ws.column_dimensions[col_letter].width = width
+    return summary_ws
+
+def update_summary(wb, data, recorded, price_index=None):
+    """
+    更新月度汇总: 只重新统计本次入账记录(generate_invoices的返回值)所在的(日期, 客户),
+    用当前已入账的记录替换这些分组原来的值,其他分组沿用已保存的汇总数据;
+    清除入账后重新生成的清单不会重复累加
+    第一次运行(还没有汇总数据工作表)时从全部已入账的记录建立
+    """
+    print("\n正在更新月度汇总...")
+    if price_index is None:
+        price_index = workbook_price_index(wb)
+    
+    # data中的入账状态是读取时的,本次入账的记录由recorded给出
+    recorded_rows = {row['row_idx'] for row in recorded}
+    counted = [row for row in data if row['入账'] == '是' or row['row_idx'] in recorded_rows]
+    
+    days = read_summary_days(wb)
+    if days is None:
+        days = summary_day_totals(counted, price_index)
+    else:
+        touched = {(row['出库日期'], row['出库对象']) for row in recorded}
+        for key in [key for key in days if key[:2] in touched]:
+            del days[key]
+        days.update(summary_day_totals(
+            (row for row in counted if (row['出库日期'], row['出库对象']) in touched), price_index))
+    
+    cube = summary_cube(days)
+    write_summary_sheet(wb, cube)
+    write_summary_days(wb, days)
+    print(f"  ✓ 本次入账 {len(recorded)} 条记录, 汇总共 {len(cube)} 行")
+    return cube
+
+def _to_float(value):
+    """转换为浮点数,无法转换时返回None"""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def _round_weight(value):
+    """净重由毛重-除皮计算时会带浮点误差,导出前去掉"""
+    value = _to_float(value)
+    return None if value is None else round(value, 6)
+
+def _to_text(value):
+    if value is None:
+        return None
+    return value if isinstance(value, str) else str(value)
+
+def _chunks(rows, size):
+    """把可迭代对象按size条切分成列表"""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# 导出列定义: (列名, 列类型),列类型用于Parquet的类型化列
+LEDGER_EXPORT_COLUMNS = [
+    ('行号', 'int'),
+    ('序号', 'int'),
+    ('出库日期', 'date'),
+    ('规格', 'str'),
+    ('个数', 'float'),
+    ('毛重', 'float'),
+    ('除皮', 'float'),
+    ('净重', 'float'),
+    ('出库对象', 'str'),
+    ('入账', 'str'),
+    ('备注', 'str'),
+]
+
+INVOICE_EXPORT_COLUMNS = [
+    ('单号', 'str'),
+    ('出库日期', 'date'),
+    ('出库对象', 'str'),
+    ('规格', 'str'),
+    ('件数', 'int'),
+    ('总净重', 'float'),
+]
+
+def ledger_export_rows(data):
+    """
+    把BondDataSheet记录规范化为导出行(元组,顺序同LEDGER_EXPORT_COLUMNS)
+    序号为公式时按公式含义(行号-1)给出数值
+    """
+    for row in data:
+        seq = row['序号']
+        if seq is None or (isinstance(seq, str) and seq.startswith('=')):
+            seq = row['row_idx'] - 1
+        out_date = row['出库日期']
+        yield (
+            row['row_idx'],
+            int(seq) if _to_float(seq) is not None else None,
+            out_date if isinstance(out_date, date) else None,
+            _to_text(row['规格']),
+            _to_float(row['个数']),
+            _to_float(row['毛重']),
+            _to_float(row['除皮']),
+            _round_weight(row['净重']),
+            _to_text(row['出库对象']),
+            _to_text(row['入账']),
+            _to_text(row['备注']),
+        )
+
+def _add_invoice_total(invoices, row):
+    """把一条记录累加到 {(日期, 客户): {规格: [件数, 总净重]}} 中(与分组规则一致,已入账的忽略)"""
+    if not can_invoice(row):
+        return
+    key = (row['出库日期'], row['出库对象'])
+    specs = invoices.setdefault(key, {})
+    total = specs.setdefault(row['规格'], [0, 0.0])
+    total[0] += 1
+    total[1] += float(row['净重']) if row['净重'] else 0.0
+
+def _invoice_total_rows(invoices):
+    """单号按分组出现顺序编号,与generate_invoices一致"""
+    for invoice_counter, ((date_obj, customer), specs) in enumerate(invoices.items(), start=1):
+        invoice_no = f"{invoice_counter:05d}"
+        for spec, (pieces, weight) in specs.items():
+            yield (invoice_no, date_obj, _to_text(customer), _to_text(spec), pieces, round(weight, 2))
+
+def model_export_rows(models):
+    """每张销售清单每个规格一行,单号和内容与生成的销售清单相同"""
+    for model in models:
+        out_date = _invoice_date(model.date_str)
+        for line in model.lines:
+            yield (model.invoice_no, out_date, _to_text(model.customer), _to_text(line.spec),
+                   line.pieces, line.weight)
+
+def write_csv(rows, columns, path, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    分批写出CSV(UTF-8 BOM,Excel可直接打开)
+    返回: 写出的行数
+    """
+    import csv
+    
+    count = 0
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([name for name, _ in columns])
+        for chunk in _chunks(rows, chunk_rows):
+            writer.writerows(
+                [value.isoformat() if isinstance(value, date) else value for value in row]
+                for row in chunk
+            )
+            count += len(chunk)
+    return count
+
+def write_parquet(rows, columns, path, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    分批写出Parquet列式文件,日期和重量为类型化列,每批一个row group
+    需要安装pyarrow(可选依赖)
+    返回: 写出的行数
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("导出Parquet需要安装pyarrow: pip install pyarrow")
+    
+    arrow_types = {'int': pa.int64(), 'float': pa.float64(), 'date': pa.date32(), 'str': pa.string()}
+    schema = pa.schema([(name, arrow_types[kind]) for name, kind in columns])
+    
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for chunk in _chunks(rows, chunk_rows):
+            arrays = [pa.array(list(col), type=field.type) for col, field in zip(zip(*chunk), schema)]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            count += len(chunk)
+    return count
+
+def export_data(data, export_dir, fmt='csv', models=None):
+    """
+    导出台账明细和销售清单汇总,供其他分析工具使用
+    data: BondDataSheet记录(列表或iter_bond_data生成器)
+    fmt: 'csv' 或 'parquet'
+    models: 将要生成的InvoiceModel列表(见prepare_invoice_models),传入时销售清单汇总
+            按其单号和内容导出; 为None时按未入账数据从00001开始编号
+    返回: 导出的文件路径列表
+    """
+    print(f"\n正在导出数据({fmt})...")
+    
+    writers = {'csv': write_csv, 'parquet': write_parquet}
+    if fmt not in writers:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+    write = writers[fmt]
+    
+    os.makedirs(export_dir, exist_ok=True)
+    ledger_path = os.path.join(export_dir, f'台账明细.{fmt}')
+    invoice_path = os.path.join(export_dir, f'销货清单汇总.{fmt}')
+    
+    # 数据为生成器时只能遍历一次,写明细的同时累加汇总
+    invoices = {}
+    
+    def counted_rows():
+        for row in data:
+            _add_invoice_total(invoices, row)
+            yield row
+    
+    ledger_count = write(ledger_export_rows(counted_rows()), LEDGER_EXPORT_COLUMNS, ledger_path)
+    print(f"  ✓ 导出台账明细: {ledger_path} ({ledger_count}行)")
+    
+    invoice_rows = _invoice_total_rows(invoices) if models is None else model_export_rows(models)
+    invoice_count = write(invoice_rows, INVOICE_EXPORT_COLUMNS, invoice_path)
+    print(f"  ✓ 导出销售清单汇总: {invoice_path} ({invoice_count}行)")
+    
+    return [ledger_path, invoice_path]
+
+def export_ledger(path, export_dir, fmt='csv', models=None, fill_defaults=True):
+    """
+    以只读方式逐行读取台账文件并导出(见export_data),内存占用与台账行数无关
+    fill_defaults: 按整理台账的规则补全空白日期和净重,与normalize阶段后的数据一致
+    返回: 导出的文件路径列表
+    """
+    wb = openpyxl.load_workbook(path, read_only=True)
+    try:
+        rows = iter_bond_data(wb[LEDGER_SCHEMA['data_sheet']], fill_defaults=fill_defaults)
+        return export_data(rows, export_dir, fmt, models)
+    finally:
+        wb.close()
+
+def plan_invoices(data, models=None):
+    """
+    计算generate_invoices将要生成的销售清单,不创建任何工作表
+    models: 按process_ledger单号规则计算的InvoiceModel列表(见plan_ledger),为None时从00001开始编号
+    返回: 可直接序列化为JSON的字典
+    """
+    if models is None:
+        models = build_invoice_models(data)
+    # upsert时清单包含该日期该客户已入账的记录,只列出本次新入账的行
+    recorded_rows = {row['row_idx'] for row in data if row['入账'] == '是'}
+    groups = []
+    for model in models:
+        groups.append({
+            'invoice_no': model.invoice_no,
+            'date': model.date_str,
+            'customer': model.customer,
+            'sheets': [invoice_sheet_name(model.customer, model.date_str, model.invoice_no, variant)
+                       for variant in INVOICE_VARIANTS],
+            'specs': [
+                {'spec': line.spec, 'pieces': line.pieces, 'net_weight': line.weight}
+                for line in model.lines
+            ],
+            'total_pieces': model.total_pieces,
+            'total_weight': model.total_weight,
+            'rows': [row_idx for row_idx in model.rows if row_idx not in recorded_rows],
+        })
+    
+    return {
+        'records': len(data),
+        'pending_records': sum(len(items) for items in group_data_by_date_and_customer(data).values()),
+        'invoices': len(groups),
+        'groups': groups,
+    }
+
+def plan_ledger(input_file, output_file=None, upsert=False, batch_size=0, issues=None,
+                export_dir=None, export_format='csv'):
+    """
+    以只读方式预览process_ledger将要生成的销售清单,单号规则与process_ledger相同:
+    写回原文件、upsert或分批模式时接着已有清单编号,只有upsert时才原位覆盖已有清单
+    output_file: 输出文件,为None时视为与输入文件不同
+    issues: 传入列表时追加数据检查结果
+    export_dir: 同时导出台账明细和销售清单汇总(见export_data),不构建完整的工作簿
+    返回: 同plan_invoices
+    """
+    data = load_bond_data(input_file, issues=issues)
+    write_back = output_file is not None and os.path.abspath(output_file) == os.path.abspath(input_file)
+    if batch_size <= 0 and not upsert and not write_back:
+        models = build_invoice_models(data)
+    else:
+        wb = openpyxl.load_workbook(input_file, read_only=True)
+        try:
+            models = prepare_invoice_models(wb, data, upsert=upsert, output_file=output_file,
+                                            batch_size=batch_size, continue_numbering=write_back)
+        finally:
+            wb.close()
+    
+    if export_dir:
+        export_data(data, export_dir, export_format, models)
+    return plan_invoices(data, models)
+
+def print_plan(plan):
+    """打印销售清单生成计划"""
+    if 'issues' in plan:
+        report_issues(plan['issues'])
+    
+    print(f"\n共 {plan['records']} 条记录, 未入账 {plan['pending_records']} 条, "
+          f"将生成 {plan['invoices']} 组销售清单")
+    
+    for group in plan['groups']:
+        print(f"\n[{group['invoice_no']}] {group['date']} - {group['customer']} "
+              f"({group['total_pieces']}件, {group['total_weight']}kg)")
+        for spec in group['specs']:
+            print(f"  {spec['spec']}: {spec['pieces']}件 {spec['net_weight']}kg")
+        print(f"  工作表: {', '.join(group['sheets'])}")
+        print(f"  标记入账的行: {', '.join(str(row) for row in group['rows'])}")
+
+# 处理阶段: 整理台账表格、生成销售清单、标记入账(含月度汇总)、保存输出文件
+STAGES = ('normalize', 'generate', 'mark', 'save')
+
+def check_stages(stages):
+    """
+    检查阶段组合,会导致台账与销售清单不一致的组合抛出ValueError:
+    只标记不生成(入账的记录没有清单)、生成并保存但不标记(已有清单的记录仍未入账,下次会重复生成)
+    """
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        raise ValueError(f"未知的阶段: {', '.join(unknown)}(可选: {', '.join(STAGES)})")
+    if 'mark' in stages and 'generate' not in stages:
+        raise ValueError("mark阶段需要同时执行generate阶段,否则入账的记录没有销售清单")
+    if 'generate' in stages and 'save' in stages and 'mark' not in stages:
+        raise ValueError("同时执行generate和save时需要mark阶段,否则保存的销售清单对应的记录仍未入账,下次会重复生成")
+
+def process_ledger(input_file, output_file, stages=STAGES, variants=INVOICE_VARIANTS,
+                   upsert=False, batch_size=0, html_path=None, export_dir=None,
+                   price_file=None, max_issues=None, export_format='csv'):
+    """
+    处理台账文件,stages中没有的阶段跳过(例如不含save时只计算不写文件),组合规则见check_stages
+    返回: 运行摘要(可直接序列化为JSON),包括各步骤耗时(秒)
+    """
+    check_stages(stages)
+    timings = {}
+    started = time.perf_counter()
+    
+    def lap(name):
+        nonlocal started
+        now = time.perf_counter()
+        timings[name] = round(now - started, 3)
+        started = now
+    
+    # 锁定台账和输出文件: 多人同时处理时排队,拿到锁后重新读取文件,只处理仍未入账的数据
+    # (输出文件与输入文件相同时,后一个人只会处理前一个人之后新增的记录;
+    #  输出到单独文件时输入没有变化,后一个人会重新处理全部记录并覆盖前一个人的输出)
+    with ledger_locks(input_file, output_file):
+        lap('lock')
         
-        invoice_counter += 1
+        # 写回原文件时其中已有之前生成的清单,单号接着编号,避免与已有清单重名;
+        # 已开出的清单只在upsert时才原位覆盖
+        write_back = os.path.abspath(output_file) == os.path.abspath(input_file)
+        
+        # 查找解析缓存(同一文件重复运行时跳过数据读取)
+        # 写回并保存时每次运行都会改变台账,缓存不可能命中,不计算哈希也不写缓存;
+        # 跳过normalize时空白日期和净重不会补全,与补全后的数据分开缓存
+        issues = []
+        use_cache = not (write_back and 'save' in stages)
+        filled = 'normalize' in stages
+        lookup = {}
+        data = ledger_cache_get(input_file, issues, filled, lookup) if use_cache else None
+        cached = data is not None
+        
+        # 加载工作簿
+        print(f"\n正在加载文件: {input_file}")
+        wb = openpyxl.load_workbook(input_file)
+        # 列位置只解析一次,整理、读取、生成和标记入账共用
+        ws = wb[LEDGER_SCHEMA['data_sheet']]
+        columns = compile_ledger_columns(ws)
+        lap('load')
+        
+        # 1. 改进BondDataTable
+        if 'normalize' in stages:
+            improve_bond_data_table(wb, columns)
+            lap('normalize')
+        
+        if data is None:
+            data = read_bond_data(ws, issues=issues, columns=columns)
+            if use_cache:
+                ledger_cache_put(input_file, data, issues, filled=filled, lookup=lookup)
+        else:
+            print("✓ 使用已缓存的BondDataSheet数据")
+        
+        # 数据检查结果(读取时已完成检查)
+        report_issues(issues, max_issues, validation_report_file(output_file))
+        write_validation_report(wb, issues)
+        lap('read')
+        
+        price_index = build_price_index(load_price_file(price_file)) if price_file else None
+        if price_index is None:
+            price_index = workbook_price_index(wb)
+        
+        # 清单内容和单号只计算一次,工作表、HTML和导出共用,单号一致
+        models = prepare_invoice_models(wb, data, price_index, upsert=upsert,
+                                        output_file=output_file, batch_size=batch_size,
+                                        continue_numbering=write_back)
+        lap('price')
+        
+        # 导出(使用已读取的数据,不再重新解析输入文件)
+        if export_dir:
+            export_data(data, export_dir, export_format, models)
+            lap('export')
+        
+        # HTML销售清单
+        if html_path:
+            write_invoices_html(data, html_path, price_index, models=models)
+            lap('html')
+        
+        # 2. 生成销售清单(入账标记在下一阶段统一处理)
+        if 'generate' in stages:
+            if batch_size > 0:
+                recorded = generate_invoices_batched(wb, output_file, batch_size, data, price_index,
+                                                     variants, mark=False, columns=columns, models=models)
+            else:
+                recorded = generate_invoices(wb, data, price_index, upsert=upsert, models=models,
+                                             variants=variants, mark=False, columns=columns)
+            lap('generate')
+        else:
+            recorded = [row for items in group_data_by_date_and_customer(data).values() for row in items]
+        
+        # 3. 标记为已入账,月度汇总只累加本次新入账的记录
+        if 'mark' in stages:
+            mark_as_recorded(ws, [row['row_idx'] for row in recorded], columns)
+            lap('mark')
+            update_summary(wb, data, recorded, price_index)
+            lap('summary')
+        
+        # 保存文件
+        if 'save' in stages:
+            print(f"\n正在保存文件: {output_file}")
+            save_workbook_atomic(wb, output_file)
+            clear_journal(output_file)
+            lap('save')
     
-    print(f"\n✓ 共生成 {len(grouped)} 组销售清单")
+    return {
+        'input': input_file,
+        'output': output_file if 'save' in stages else None,
+        'stages': [stage for stage in STAGES if stage in stages],
+        'variants': list(variants),
+        'records': len(data),
+        'cached': cached,
+        'issues': len(issues),
+        'invoices': len({(row['出库日期'], row['出库对象']) for row in recorded}) if 'generate' in stages else 0,
+        'recorded_rows': len(recorded) if 'mark' in stages else 0,
+        'timings': timings,
+        'total_seconds': round(sum(timings.values()), 3),
+    }
 
 def main():
     """
     主函数
     """
-    input_file = '库存tmep.xlsx'
-    output_file = '库存_改进版.xlsx'
+    import argparse
+    import sys
+    from contextlib import redirect_stdout
     
-    print("=" * 60)
-    print("库存表改进脚本")
-    print("=" * 60)
+    parser = argparse.ArgumentParser(description='库存表改进脚本')
+    parser.add_argument('-i', '--input', default='库存tmep.xlsx', metavar='PATH',
+                        help='台账文件(默认: %(default)s)')
+    parser.add_argument('-o', '--output', default='库存_改进版.xlsx', metavar='PATH',
+                        help='输出文件,与输入文件相同时写回原文件(默认: %(default)s)')
+    parser.add_argument('--stages', default=','.join(STAGES), metavar='LIST',
+                        help=f'要执行的阶段,逗号分隔,可选: {",".join(STAGES)}(默认全部)')
+    variant_group = parser.add_mutually_exclusive_group()
+    variant_group.add_argument('--simple-only', action='store_true', help='只生成简单版销售清单')
+    variant_group.add_argument('--detailed-only', action='store_true', help='只生成详细版销售清单')
+    parser.add_argument('--plan', action='store_true',
+                        help='只读取和分组,预览将要生成的销售清单,不修改或保存文件')
+    parser.add_argument('--json', action='store_true',
+                        help='以JSON格式输出: 配合--plan时输出计划,否则输出运行摘要和各步骤耗时(处理日志改为输出到stderr)')
+    parser.add_argument('--upsert', action='store_true',
+                        help='同一日期和客户已有销售清单时原位覆盖,不再新增工作表')
+    parser.add_argument('--html', metavar='PATH',
+                        help='同时生成可打印的HTML销售清单: 以.html结尾时生成一个分页文件,否则为每张清单一个文件的目录')
+    parser.add_argument('--batch-size', type=int, default=0, metavar='N',
+                        help='分批模式: 每N组销售清单保存为一个单独的文件并释放内存,中断后重新运行跳过已完成的清单')
+    parser.add_argument('--schema', metavar='PATH',
+                        help=f'台账结构配置文件(JSON),默认查找输入文件目录下的{SCHEMA_FILE_NAME}')
+    parser.add_argument('--max-issues', type=int, default=None,
+                        help='数据检查发现的问题超过该数量时停止,不生成销售清单')
+    parser.add_argument('--export-dir', metavar='DIR',
+                        help='同时导出台账明细和销售清单汇总供其他分析工具使用')
+    parser.add_argument('--export-format', choices=('csv', 'parquet'), default='csv',
+                        help='导出格式,parquet需要安装pyarrow(默认: %(default)s)')
+    parser.add_argument('--price-file', metavar='PATH',
+                        help='价格表文件(xlsx/csv),默认使用工作簿中的PriceSheet(如果有)')
+    args = parser.parse_args()
+    
+    stages = tuple(stage.strip() for stage in args.stages.split(',') if stage.strip())
+    try:
+        check_stages(stages)
+    except ValueError as e:
+        parser.error(str(e))
+    
+    if args.simple_only:
+        variants = ('简单版',)
+    elif args.detailed_only:
+        variants = ('详细版',)
+    else:
+        variants = INVOICE_VARIANTS
     
-    # 加载工作簿
-    print(f"\n正在加载文件: {input_file}")
-    wb = openpyxl.load_workbook(input_file)
+    input_file = args.input
+    output_file = args.output
     
-    # 1. 改进BondDataTable
-    improve_bond_data_table(wb)
+    load_schema(args.schema or find_schema_file(input_file))
     
-    # 2. 生成销售清单
-    generate_invoices(wb)
+    if args.plan:
+        issues = []
+        # JSON模式下stdout只输出计划,读取价格表等日志输出到stderr
+        with redirect_stdout(sys.stderr if args.json else sys.stdout):
+            plan = plan_ledger(input_file, output_file, upsert=args.upsert, batch_size=args.batch_size,
+                               issues=issues, export_dir=args.export_dir, export_format=args.export_format)
+        plan['issues'] = issues
+        if args.json:
+            print(json.dumps(plan, ensure_ascii=False, indent=2, default=str))
+        else:
+            print_plan(plan)
+        return
+    
+    # JSON模式下stdout只输出摘要,处理日志输出到stderr
+    with redirect_stdout(sys.stderr if args.json else sys.stdout):
+        print("=" * 60)
+        print("库存表改进脚本")
+        print("=" * 60)
+        
+        summary = process_ledger(input_file, output_file, stages, variants,
+                                 upsert=args.upsert, batch_size=args.batch_size, html_path=args.html,
+                                 export_dir=args.export_dir, price_file=args.price_file,
+                                 max_issues=args.max_issues, export_format=args.export_format)
     
-    # 保存文件
-    print(f"\n正在保存文件: {output_file}")
-    wb.save(output_file)
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+        return
     
     print("\n" + "=" * 60)
     print("✓ 所有操作完成!")
     print("=" * 60)
+    if 'save' not in stages:
+        print("\n未执行save阶段,没有写入输出文件")
+        return
     print(f"\n输出文件: {output_file}")
     print("\n说明:")
     print("1. BondDataTable已优化,新增行会自动填充序号和日期")
     print("2. 已为所有未入账的数据生成销售清单(简单版+详细版)")
     print("3. 已生成清单的数据在'入账'列标记为'是'")
-    print("4. 销售清单中的单价和金额需要手动填写")
+    print(f"4. 按月、按客户和规格的汇总见'{SUMMARY_SHEET_NAME}'工作表")
+    print("5. 价格表中没有的单价和金额需要手动填写")
 
 if __name__ == '__main__':
     main()
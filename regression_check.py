@@ -0,0 +1,609 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+回归检查脚本 - 确认各种处理方式(默认、分批、原位覆盖)生成的销售清单
+与基准文件完全一致,基准文件与优化前的原始脚本输出一致,
+缓存、中断续传、预览、HTML、导出和多人排队的结果与基准相同,并检查处理速度没有明显下降
+
+用法:
+  python regression_check.py                     对比基准文件并检查速度
+  python regression_check.py --update            用当前代码重新生成基准文件(确认输出正确后再执行)
+  python regression_check.py --update-reference 原始脚本.py
+                                                 用优化前的原始脚本重新生成参考基准
+  python regression_check.py --no-perf           只对比输出,不检查速度
+  python regression_check.py --min-rows-per-second 500 --min-invoices-per-second 5
+                                                 在较慢的电脑上放宽最低处理速度
+"""
+
+import argparse
+import csv
+import html
+import io
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+from contextlib import contextmanager, redirect_stdout
+from datetime import datetime, timedelta
+
+import openpyxl
+from openpyxl.worksheet.table import Table
+
+import improve_inventory
+
+# 基准文件目录
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'regression')
+
+# 参考基准: 优化前的原始脚本对同样台账的输出(已提交的文件即为准,检查时不需要原始脚本)
+REFERENCE_DIR = os.path.join(GOLDEN_DIR, 'reference')
+
+# 基准文件中比原始脚本多出的工作表
+ADDED_SHEETS = (improve_inventory.SUMMARY_SHEET_NAME, improve_inventory.SUMMARY_DATA_SHEET_NAME)
+DETAIL_PREFIX = '明细净重(kg): '
+AMOUNT_PREFIXES = ('合计金额(大写): ', '合计金额(小写): ¥')
+
+# 多人排队检查: 等待多久确认第二次处理在排队,以及处理完成的最长时间(秒)
+LOCK_QUEUE_SECONDS = 2
+LOCK_FINISH_SECONDS = 60
+
+# 回归场景: 名称 -> 合成台账参数
+SCENARIOS = {
+    'basic': {'rows': 80, 'days': 6, 'customers': 3, 'seed': 1, 'prices': False},
+    'priced': {'rows': 80, 'days': 6, 'customers': 3, 'seed': 2, 'prices': True},
+}
+
+# 速度检查: 合成台账的规模和默认最低处理速度(按较旧的办公电脑留足余量,可用命令行参数调整)
+PERF_SCENARIO = {'rows': 5000, 'days': 40, 'customers': 5, 'seed': 3, 'prices': True}
+MIN_ROWS_PER_SECOND = 1000  # 加载和读取台账
+MIN_INVOICES_PER_SECOND = 10  # 生成销售清单(简单版+详细版)
+
+# 差异太多时只列出前几条
+MAX_REPORTED_DIFFS = 10
+
+SPECS = ('0.5mm', '0.8mm', '1.0mm', '金丝A', '银丝B')
+CUSTOMERS = ('甲公司', '乙公司', '丙公司', '丁公司', '戊公司')
+
+def make_ledger(path, rows, days, customers, seed, prices):
+    """
+    生成合成台账: 结构与实际台账相同(BondDataTable、序号和净重公式、TemplateSheet)
+    前5行是上个月已入账的记录,其余未入账,从2026-01-01起分布在days天内;
+    固定随机种子,每次生成的内容相同
+    """
+    start = datetime(2026, 1, 1)
+    rng = random.Random(seed)
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = 'BondDataSheet'
+    ws.append(list(improve_inventory.LEDGER_FIELDS))
+
+    for i in range(rows):
+        gross = round(rng.uniform(20, 30), 2)
+        tare = round(rng.uniform(1, 2), 2)
+        ws.append([
+            '=ROW(BondDataTable[[#This Row],[序号]])-1',
+            start - timedelta(days=1) if i < 5 else start + timedelta(days=i * days // rows),
+            rng.choice(SPECS),
+            1,
+            gross,
+            tare,
+            '=BondDataTable[[#This Row],[毛重]]-BondDataTable[[#This Row],[除皮]]',
+            rng.choice(CUSTOMERS[:customers]),
+            '是' if i < 5 else None,
+            None,
+        ])
+    ws.add_table(Table(displayName='BondDataTable', ref=f'A1:J{rows + 1}'))
+
+    template_ws = wb.create_sheet('TemplateSheet')
+    template_ws['A1'] = improve_inventory.COMPANY_NAME
+    template_ws.merge_cells('A1:I1')
+    for col, header in enumerate(('产品名称', '件数', '重量', '单价', '金额', '备注'), start=1):
+        template_ws.cell(4, col).value = header
+
+    if prices:
+        price_ws = wb.create_sheet(improve_inventory.PRICE_SHEET_NAME)
+        price_ws.append(list(improve_inventory.PRICE_HEADERS))
+        for spec in SPECS[:3]:
+            price_ws.append([None, spec, datetime(2025, 12, 1), round(rng.uniform(50, 90), 2)])
+        # 只对一个客户生效的新单价,检查按日期取价
+        price_ws.append([CUSTOMERS[0], SPECS[0], start + timedelta(days=days // 2), 99.5])
+
+    wb.save(path)
+
+def sheet_cells(ws):
+    """工作表中非空单元格: {坐标: 值}"""
+    return {
+        cell.coordinate: cell.value
+        for row in ws.iter_rows()
+        for cell in row
+        if cell.value is not None
+    }
+
+def recorded_rows(ws):
+    """台账中'入账'列标记为'是'的行号"""
+    column = improve_inventory.compile_ledger_columns(ws)['column']['入账']
+    return {
+        row_idx
+        for row_idx, row in enumerate(ws.iter_rows(min_row=2, values_only=True), start=2)
+        if row[column - 1] == '是'
+    }
+
+def compare_sheets(expected, actual, check_order=True, equivalent=None):
+    """
+    按内容比较两组工作表({名称: 工作表}): 单元格值、合并单元格、台账的入账标记
+    equivalent: 允许的差异,equivalent(工作表名, 坐标, 期望值, 实际值)为True时不算差异
+    返回: 差异说明列表(为空表示一致)
+    """
+    diffs = []
+    if check_order and list(expected) != list(actual):
+        diffs.append(f"工作表顺序不同: {list(expected)} != {list(actual)}")
+    for name in expected.keys() - actual.keys():
+        diffs.append(f"缺少工作表: {name}")
+    for name in actual.keys() - expected.keys():
+        diffs.append(f"多出工作表: {name}")
+
+    data_sheet = improve_inventory.LEDGER_SCHEMA['data_sheet']
+    for name in expected:
+        if name not in actual:
+            continue
+        expected_ws, actual_ws = expected[name], actual[name]
+
+        if name == data_sheet:
+            expected_rows, actual_rows = recorded_rows(expected_ws), recorded_rows(actual_ws)
+            if expected_rows != actual_rows:
+                diffs.append(f"{name}: 入账标记不同, 缺少 {sorted(expected_rows - actual_rows)}, "
+                             f"多出 {sorted(actual_rows - expected_rows)}")
+
+        expected_merged = {str(r) for r in expected_ws.merged_cells.ranges}
+        actual_merged = {str(r) for r in actual_ws.merged_cells.ranges}
+        if expected_merged != actual_merged:
+            diffs.append(f"{name}: 合并单元格不同, 缺少 {sorted(expected_merged - actual_merged)}, "
+                         f"多出 {sorted(actual_merged - expected_merged)}")
+
+        expected_cells, actual_cells = sheet_cells(expected_ws), sheet_cells(actual_ws)
+        for coord in sorted(expected_cells.keys() | actual_cells.keys()):
+            expected_value, actual_value = expected_cells.get(coord), actual_cells.get(coord)
+            if expected_value == actual_value:
+                continue
+            if equivalent is None or not equivalent(name, coord, expected_value, actual_value):
+                diffs.append(f"{name}!{coord}: {expected_value!r} != {actual_value!r}")
+    return diffs
+
+def workbook_sheets(*paths):
+    """读取一个或多个工作簿(例如分批模式的主文件和各批文件),合并为{名称: 工作表}"""
+    sheets = {}
+    for path in paths:
+        wb = openpyxl.load_workbook(path)
+        for ws in wb.worksheets:
+            sheets[ws.title] = ws
+    return sheets
+
+def run_pipeline(input_file, output_file, **kwargs):
+    """运行improve_inventory的处理流程,不输出处理日志"""
+    with redirect_stdout(io.StringIO()):
+        return improve_inventory.process_ledger(input_file, output_file, **kwargs)
+
+def restore_marks(path, source):
+    """把台账的入账标记恢复为source中的状态,模拟对已含销售清单的工作簿重新生成"""
+    data_sheet = improve_inventory.LEDGER_SCHEMA['data_sheet']
+    marked = recorded_rows(openpyxl.load_workbook(source)[data_sheet])
+    wb = openpyxl.load_workbook(path)
+    ws = wb[data_sheet]
+    column = improve_inventory.compile_ledger_columns(ws)['column']['入账']
+    for row_idx in range(2, ws.max_row + 1):
+        ws.cell(row_idx, column).value = '是' if row_idx in marked else None
+    wb.save(path)
+
+def append_late_row(path):
+    """在台账末尾追加一条未入账记录,日期和客户与最后一条记录相同(已开出清单后才补录的记录)"""
+    wb = openpyxl.load_workbook(path)
+    ws = wb[improve_inventory.LEDGER_SCHEMA['data_sheet']]
+    last = [cell.value for cell in ws[ws.max_row]]
+    fields = improve_inventory.LEDGER_FIELDS
+    last[fields.index('毛重')] = 25.0
+    last[fields.index('除皮')] = 1.0
+    last[fields.index('入账')] = None
+    ws.append(last)
+    wb.save(path)
+
+def check_engines(name, golden_file, work_dir):
+    """
+    用各种处理方式处理同一合成台账,与基准文件比较
+    返回: {处理方式: 差异列表}
+    """
+    input_file = os.path.join(work_dir, '台账.xlsx')
+    make_ledger(input_file, **SCENARIOS[name])
+    expected = workbook_sheets(golden_file)
+    results = {}
+
+    # 默认: 一次生成全部清单,最后保存
+    output_file = os.path.join(work_dir, '默认.xlsx')
+    run_pipeline(input_file, output_file)
+    results['默认'] = compare_sheets(expected, workbook_sheets(output_file))
+
+    # 只生成一种版式: 两次结果合在一起应与基准相同
+    simple_file = os.path.join(work_dir, '简单版.xlsx')
+    detailed_file = os.path.join(work_dir, '详细版.xlsx')
+    run_pipeline(input_file, simple_file, variants=('简单版',))
+    run_pipeline(input_file, detailed_file, variants=('详细版',))
+    results['分版式'] = compare_sheets(expected, workbook_sheets(simple_file, detailed_file), check_order=False)
+
+    # 分批: 清单分散在各批文件中,主文件只有台账和汇总
+    output_file = os.path.join(work_dir, '分批.xlsx')
+    run_pipeline(input_file, output_file, batch_size=3)
+    batch_files = []
+    batch_no = 1
+    while os.path.exists(improve_inventory.batch_file_name(output_file, batch_no)):
+        batch_files.append(improve_inventory.batch_file_name(output_file, batch_no))
+        batch_no += 1
+    results['分批'] = compare_sheets(expected, workbook_sheets(output_file, *batch_files), check_order=False)
+
+    # 原位覆盖: 恢复本次运行前的入账标记后以upsert写回,清单应原位重新生成,内容不变
+    output_file = os.path.join(work_dir, '覆盖.xlsx')
+    shutil.copyfile(golden_file, output_file)
+    restore_marks(output_file, input_file)
+    # 重新入账的记录不能再次累加到月度汇总,汇总也参与比较
+    run_pipeline(output_file, output_file, upsert=True)
+    results['原位覆盖'] = compare_sheets(expected, workbook_sheets(output_file))
+
+    # 写回(不加upsert): 已开出的清单不变,补录的记录单独开一张接着最大单号的新清单
+    output_file = os.path.join(work_dir, '写回.xlsx')
+    shutil.copyfile(golden_file, output_file)
+    append_late_row(output_file)
+    run_pipeline(output_file, output_file)
+    actual = workbook_sheets(output_file)
+    invoices = {title: ws for title, ws in expected.items() if title.startswith('销货清单_')}
+    diffs = compare_sheets(invoices, {title: actual[title] for title in invoices if title in actual})
+    index = improve_inventory.index_invoice_sheets(openpyxl.load_workbook(golden_file))
+    next_no = f"{improve_inventory.max_invoice_no(index) + 1:05d}"
+    added = sorted(title for title in actual.keys() - expected.keys())
+    if len(added) != 2 or not all(f"_{next_no}_" in title for title in added):
+        diffs.append(f"补录记录应生成单号{next_no}的一组新清单,实际新增: {added}")
+    results['写回'] = diffs
+
+    # 只覆盖一种版式: 补录记录后以upsert写回,另一版式也要一起重新生成,结果与两种版式都覆盖时相同
+    both_file = os.path.join(work_dir, '覆盖补录.xlsx')
+    simple_file = os.path.join(work_dir, '覆盖补录_简单版.xlsx')
+    for path, variants in ((both_file, improve_inventory.INVOICE_VARIANTS), (simple_file, ('简单版',))):
+        shutil.copyfile(golden_file, path)
+        append_late_row(path)
+        run_pipeline(path, path, upsert=True, variants=variants)
+    results['单版式覆盖'] = compare_sheets(workbook_sheets(both_file), workbook_sheets(simple_file))
+
+    return results
+
+def load_reference_module(script_file):
+    """把优化前的原始脚本文件作为独立模块加载(不影响当前模块)"""
+    with open(script_file, 'rb') as f:
+        source = f.read()
+    module = types.ModuleType('improve_inventory_reference')
+    exec(compile(source, script_file, 'exec'), module.__dict__)
+    return module
+
+def _detail_weights(value):
+    """明细净重文本中的各个净重,不是明细净重时返回None"""
+    if not isinstance(value, str) or not value.startswith(DETAIL_PREFIX):
+        return None
+    try:
+        return [float(weight) for weight in value[len(DETAIL_PREFIX):].split(',')]
+    except ValueError:
+        return None
+
+def reference_equivalent(priced):
+    """
+    基准文件与原始脚本输出之间允许的差异:
+    - 明细净重改为固定两位小数(25.3 → 25.30),按数值比较
+    - 有价格表时,原始脚本留空的单价、金额(D、E列)和合计金额由价格表填写
+    """
+    def equivalent(sheet_name, coord, expected, actual):
+        weights = _detail_weights(expected)
+        if weights is not None and weights == _detail_weights(actual):
+            return True
+        if not priced or not sheet_name.startswith('销货清单_'):
+            return False
+        if expected is None and coord[0] in 'DE' and isinstance(actual, (int, float)):
+            return True
+        return expected in AMOUNT_PREFIXES and isinstance(actual, str) and actual.startswith(expected)
+    return equivalent
+
+def check_reference(name, golden_file):
+    """
+    确认基准文件与原始脚本的输出一致: 基准文件由当前代码生成,
+    这里保证它只在reference_equivalent列出的方面与原始行为不同
+    返回: 差异列表
+    """
+    reference_file = os.path.join(REFERENCE_DIR, f'{name}.xlsx')
+    if not os.path.exists(reference_file):
+        return [f"缺少参考基准 {reference_file},请先运行: python regression_check.py --update-reference 原始脚本.py"]
+    golden = {title: ws for title, ws in workbook_sheets(golden_file).items() if title not in ADDED_SHEETS}
+    return compare_sheets(workbook_sheets(reference_file), golden,
+                          equivalent=reference_equivalent(SCENARIOS[name]['prices']))
+
+def golden_invoices(golden_file):
+    """
+    基准文件中每张销售清单的内容(从详细版读取)
+    返回: {单号: (日期字符串, 客户, [(规格, 件数, 总重量)])}
+    """
+    wb = openpyxl.load_workbook(golden_file)
+    invoices = {}
+    for (date_str, customer), entry in improve_inventory.index_invoice_sheets(wb).items():
+        lines = [
+            (str(spec), pieces, weight)
+            for spec, pieces, weight in entry['详细版'].iter_rows(min_row=6, max_col=3, values_only=True)
+            if isinstance(pieces, int)  # 明细净重和汇总行的B列为空
+        ]
+        invoices[entry['invoice_no']] = (date_str, customer, lines)
+    return invoices
+
+def compare_invoices(expected, actual):
+    """比较两组 {单号: (日期, 客户, 各规格)},返回差异列表"""
+    diffs = []
+    for invoice_no in sorted(expected.keys() | actual.keys()):
+        if expected.get(invoice_no) != actual.get(invoice_no):
+            diffs.append(f"单号{invoice_no}: {expected.get(invoice_no)} != {actual.get(invoice_no)}")
+    return diffs
+
+def plan_invoices(plan):
+    """预览结果整理为golden_invoices的格式"""
+    return {
+        group['invoice_no']: (group['date'], group['customer'],
+                              [(str(spec['spec']), spec['pieces'], spec['net_weight']) for spec in group['specs']])
+        for group in plan['groups']
+    }
+
+HTML_FIELDS = {
+    'invoice_no': re.compile(r'No\. ([^<]+)</span>'),
+    'date': re.compile(r'开单日期: ([^<]+)</div>'),
+    'customer': re.compile(r'客户: ([^<]+)</span>'),
+}
+HTML_LINE = re.compile(r'<tr><td>([^<]*)</td><td>(\d+)</td><td>([\d.]+)</td>')
+
+def html_invoices(html_dir):
+    """HTML目录中每张清单(每个文件一张)整理为golden_invoices的格式"""
+    invoices = {}
+    for file_name in sorted(os.listdir(html_dir)):
+        with open(os.path.join(html_dir, file_name), encoding='utf-8') as f:
+            page = html.unescape(f.read())
+        fields = {key: pattern.search(page) for key, pattern in HTML_FIELDS.items()}
+        if not all(fields.values()):
+            invoices[file_name] = None
+            continue
+        lines = [(spec, int(pieces), float(weight)) for spec, pieces, weight in HTML_LINE.findall(page)]
+        invoices[fields['invoice_no'].group(1)] = (fields['date'].group(1), fields['customer'].group(1), lines)
+    return invoices
+
+def export_invoices(export_dir):
+    """导出的销货清单汇总.csv整理为golden_invoices的格式"""
+    invoices = {}
+    with open(os.path.join(export_dir, '销货清单汇总.csv'), encoding='utf-8-sig', newline='') as f:
+        for row in csv.DictReader(f):
+            entry = invoices.setdefault(row['单号'], (row['出库日期'], row['出库对象'], []))
+            entry[2].append((row['规格'], int(row['件数']), float(row['总净重'])))
+    return invoices
+
+def batch_output_sheets(output_file):
+    """分批模式的主文件和所有分批文件中的工作表"""
+    return workbook_sheets(output_file, *[path for _, path in improve_inventory.existing_batch_files(output_file)])
+
+class SimulatedCrash(Exception):
+    """模拟分批处理中途断电"""
+
+@contextmanager
+def cache_dir(path):
+    """临时使用单独的解析缓存目录"""
+    previous = os.environ.get(improve_inventory.CACHE_DIR_ENV)
+    os.environ[improve_inventory.CACHE_DIR_ENV] = path
+    try:
+        yield
+    finally:
+        if previous is None:
+            del os.environ[improve_inventory.CACHE_DIR_ENV]
+        else:
+            os.environ[improve_inventory.CACHE_DIR_ENV] = previous
+
+def start_processing(input_file, output_file):
+    """在另一个进程中处理台账(模拟另一个用户同时点击处理)"""
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'improve_inventory.py')
+    return subprocess.Popen([sys.executable, script, '-i', input_file, '-o', output_file],
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+def finished_output(process, output_file, expected):
+    """等待另一个进程处理完成并与基准比较,返回差异列表"""
+    try:
+        _, stderr = process.communicate(timeout=LOCK_FINISH_SECONDS)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        return [f"{LOCK_FINISH_SECONDS}秒内没有完成处理"]
+    if process.returncode != 0:
+        return [f"处理失败: {stderr.decode('utf-8', 'replace').strip()}"]
+    return compare_sheets(expected, workbook_sheets(output_file))
+
+def check_stateful(name, golden_file, work_dir):
+    """
+    检查有状态的处理路径,结果都应与基准文件一致:
+    缓存命中、分批中断后续传、预览、HTML、导出、多人排队和过期锁
+    返回: {检查项: 差异列表}
+    """
+    input_file = os.path.join(work_dir, '状态台账.xlsx')
+    make_ledger(input_file, **SCENARIOS[name])
+    expected = workbook_sheets(golden_file)
+    invoices = golden_invoices(golden_file)
+    results = {}
+
+    # 缓存: 第二次运行命中缓存,同时生成HTML和导出
+    with cache_dir(os.path.join(work_dir, 'cache')):
+        first = run_pipeline(input_file, os.path.join(work_dir, '缓存1.xlsx'))
+        output_file = os.path.join(work_dir, '缓存2.xlsx')
+        html_dir = os.path.join(work_dir, 'html')
+        export_dir = os.path.join(work_dir, 'export')
+        second = run_pipeline(input_file, output_file, html_path=html_dir, export_dir=export_dir)
+        with redirect_stdout(io.StringIO()):
+            plan = improve_inventory.plan_ledger(input_file, output_file)
+    diffs = [] if second['cached'] and not first['cached'] else ["第二次运行没有使用解析缓存"]
+    results['缓存'] = diffs + compare_sheets(expected, workbook_sheets(output_file))
+    results['预览'] = compare_invoices(invoices, plan_invoices(plan))
+    results['HTML'] = compare_invoices(invoices, html_invoices(html_dir))
+    results['导出'] = compare_invoices(invoices, export_invoices(export_dir))
+
+    # 中断续传: 第一批写入日志后中断,重新运行应跳过已完成的清单,结果与一次完成相同
+    output_file = os.path.join(work_dir, '续传.xlsx')
+    append_journal = improve_inventory._append_journal
+
+    def crash_after_first_batch(path, entries):
+        append_journal(path, entries)
+        raise SimulatedCrash()
+
+    diffs = []
+    improve_inventory._append_journal = crash_after_first_batch
+    try:
+        run_pipeline(input_file, output_file, batch_size=3)
+        diffs.append("模拟中断没有发生")
+    except SimulatedCrash:
+        pass
+    finally:
+        improve_inventory._append_journal = append_journal
+    if not improve_inventory.read_journal(output_file):
+        diffs.append("中断后没有留下运行日志")
+    run_pipeline(input_file, output_file, batch_size=3)
+    if os.path.exists(improve_inventory.journal_file_name(output_file)):
+        diffs.append("完成后运行日志没有删除")
+    results['中断续传'] = diffs + compare_sheets(expected, batch_output_sheets(output_file), check_order=False)
+
+    # 多人排队: 持有台账锁时另一次处理等待,释放后完成
+    output_file = os.path.join(work_dir, '排队.xlsx')
+    diffs = []
+    with improve_inventory.ledger_lock(input_file):
+        process = start_processing(input_file, output_file)
+        try:
+            process.wait(LOCK_QUEUE_SECONDS)
+            diffs.append("持有锁时另一次处理没有等待")
+        except subprocess.TimeoutExpired:
+            pass
+    results['排队'] = diffs + finished_output(process, output_file, expected)
+
+    # 过期锁: 异常退出留下的空锁文件不能一直阻塞处理
+    output_file = os.path.join(work_dir, '过期锁.xlsx')
+    lock_file = os.path.abspath(input_file) + '.lock'
+    open(lock_file, 'w').close()
+    stale = time.time() - 2 * improve_inventory.LOCK_STALE_SECONDS
+    os.utime(lock_file, (stale, stale))
+    diffs = finished_output(start_processing(input_file, output_file), output_file, expected)
+    if os.path.exists(lock_file):
+        diffs.append("过期锁文件没有清除")
+    results['过期锁'] = diffs
+
+    return results
+
+def check_performance(work_dir):
+    """
+    在较大的合成台账上测量处理速度(不保存文件)
+    返回: (每秒处理记录数, 每秒生成清单数, 运行摘要)
+    """
+    input_file = os.path.join(work_dir, '速度.xlsx')
+    make_ledger(input_file, **PERF_SCENARIO)
+    summary = run_pipeline(input_file, os.path.join(work_dir, '速度_输出.xlsx'),
+                           stages=('normalize', 'generate', 'mark'))
+    timings = summary['timings']
+    rows_per_second = summary['records'] / max(timings['load'] + timings['read'], 1e-6)
+    invoices_per_second = summary['invoices'] / max(timings['generate'], 1e-6)
+    return rows_per_second, invoices_per_second, summary
+
+def update_golden():
+    """用当前代码重新生成基准文件"""
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+    for name, params in SCENARIOS.items():
+        work_dir = tempfile.mkdtemp(prefix='inventory_golden_')
+        try:
+            input_file = os.path.join(work_dir, '台账.xlsx')
+            make_ledger(input_file, **params)
+            golden_file = os.path.join(GOLDEN_DIR, f'{name}.xlsx')
+            run_pipeline(input_file, golden_file)
+            print(f"✓ 已生成基准文件: {golden_file}")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def update_reference(script_file):
+    """用优化前的原始脚本(script_file)重新生成参考基准"""
+    reference = load_reference_module(script_file)
+    os.makedirs(REFERENCE_DIR, exist_ok=True)
+    for name, params in SCENARIOS.items():
+        reference_file = os.path.join(REFERENCE_DIR, f'{name}.xlsx')
+        make_ledger(reference_file, **params)
+        wb = openpyxl.load_workbook(reference_file)
+        with redirect_stdout(io.StringIO()):
+            reference.improve_bond_data_table(wb)
+            reference.generate_invoices(wb)
+        wb.save(reference_file)
+        print(f"✓ 已生成参考基准: {reference_file}")
+
+def main():
+    parser = argparse.ArgumentParser(description='回归检查: 对比基准文件并检查处理速度')
+    parser.add_argument('--update', action='store_true', help='用当前代码重新生成基准文件')
+    parser.add_argument('--update-reference', metavar='SCRIPT',
+                        help='用优化前的原始脚本文件重新生成参考基准')
+    parser.add_argument('--no-perf', action='store_true', help='不检查处理速度')
+    parser.add_argument('--min-rows-per-second', type=float, default=MIN_ROWS_PER_SECOND, metavar='N',
+                        help=f'读取台账的最低速度(条/秒,默认{MIN_ROWS_PER_SECOND})')
+    parser.add_argument('--min-invoices-per-second', type=float, default=MIN_INVOICES_PER_SECOND, metavar='N',
+                        help=f'生成清单的最低速度(组/秒,默认{MIN_INVOICES_PER_SECOND})')
+    args = parser.parse_args()
+
+    improve_inventory.load_schema()
+
+    if args.update or args.update_reference:
+        if args.update_reference:
+            update_reference(args.update_reference)
+        if args.update:
+            update_golden()
+        return 0
+
+    failed = False
+    for name in SCENARIOS:
+        golden_file = os.path.join(GOLDEN_DIR, f'{name}.xlsx')
+        if not os.path.exists(golden_file):
+            print(f"✗ 缺少基准文件 {golden_file},请先运行: python regression_check.py --update")
+            return 1
+
+        work_dir = tempfile.mkdtemp(prefix='inventory_regression_')
+        try:
+            results = check_engines(name, golden_file, work_dir)
+            results['原始脚本'] = check_reference(name, golden_file)
+            results.update(check_stateful(name, golden_file, work_dir))
+            for engine, diffs in results.items():
+                if not diffs:
+                    print(f"✓ {name} / {engine}: 与基准一致")
+                    continue
+                failed = True
+                print(f"✗ {name} / {engine}: {len(diffs)} 处差异")
+                for diff in diffs[:MAX_REPORTED_DIFFS]:
+                    print(f"    {diff}")
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if not args.no_perf:
+        work_dir = tempfile.mkdtemp(prefix='inventory_perf_')
+        try:
+            rows_per_second, invoices_per_second, summary = check_performance(work_dir)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+        print(f"\n速度: {summary['records']} 条记录, {summary['invoices']} 组清单, 耗时 {summary['timings']}")
+        for label, value, minimum in (('读取台账', rows_per_second, args.min_rows_per_second),
+                                      ('生成清单', invoices_per_second, args.min_invoices_per_second)):
+            unit = '条/秒' if label == '读取台账' else '组/秒'
+            if value >= minimum:
+                print(f"✓ {label}: {value:.0f} {unit} (最低 {minimum:g})")
+            else:
+                failed = True
+                print(f"✗ {label}: {value:.0f} {unit},低于最低要求 {minimum:g}")
+
+    print("\n" + ("✗ 回归检查未通过" if failed else "✓ 回归检查通过"))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())